@@ -0,0 +1,160 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of the core computational paths of CrysFiPy
+
+Run from the repository root:
+
+    python benchmarks/bench.py --save results.json
+    python benchmarks/bench.py --compare results.json --threshold 0.2
+
+Every case reports throughput (calls per second, best of several repeats)
+and peak memory allocated during one call. With ``--compare`` the script
+exits with status 1 if any case is slower than the baseline by more than
+the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import crysfipy
+import crysfipy.cfmatrix as M
+from crysfipy.reion import re, susceptibility, neutronint, rebatch
+
+HO = ["t", -0.173477508, 0.001084591, -0.012701252, -3.34835E-06, 0.0000097]
+
+
+def _operators(J):
+    def run():
+        M.operators_cache_clear()
+        M.operators(J)
+    return run
+
+def _construct():
+    re("Ho", [0, 0, 1], HO)
+
+def _getlevels():
+    ion = re("Ho", [0, 0, 1], HO, calculate = False)
+    ion.getlevels()
+    ion.deg_Jt2
+
+def _import(module):
+    # fresh interpreter, includes its startup time
+    def run():
+        subprocess.run([sys.executable, "-c", "import " + module], check = True, cwd = ROOT)
+    run.subprocess = True    # memory of the child is not traced
+    return run
+
+def cases():
+    """Returns dictionary of benchmark name -> callable"""
+    ret = {}
+    ret["import[crysfipy.const]"] = _import("crysfipy.const")
+    ret["import[crysfipy.reion]"] = _import("crysfipy.reion")
+    for i in crysfipy.const.ions():
+        ret["operators[%s]" % i.name.title()] = _operators(i.J)
+    ret["re"] = _construct
+    ret["getlevels"] = _getlevels
+    ion = re("Ho", [0, 0, 1], HO)
+    ion.deg_Jt2
+    T = np.linspace(1, 300, 1000)
+    ret["susceptibility[1000 T]"] = lambda: susceptibility(ion, T)
+    ret["neutronint"] = lambda: neutronint(ion, 10)
+    pars = np.tile(ion._pars, (1000, 1))
+    ret["rebatch[1000]"] = lambda: rebatch("Ho", [0, 0, 1], pars)
+    return ret
+
+def measure(func, repeat = 5, mintime = 0.1):
+    """Returns throughput in calls per second and peak memory in bytes
+
+    Peak memory is None for cases running in a subprocess.
+    """
+    func()                         # warm up
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        dt = time.perf_counter() - t0
+        if dt >= mintime:
+            break
+        number *= 2
+    best = dt
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - t0)
+    if getattr(func, "subprocess", False):
+        return number / best, None
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return number / best, peak
+
+def compare(results, baseline, threshold):
+    """Prints comparison with baseline and returns names of regressed cases"""
+    regressed = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        ratio = baseline[name]["throughput"] / r["throughput"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        print("%-28s %8.2fx time of baseline%s" % (name, ratio, flag))
+    return regressed
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--save", help = "save results to JSON file")
+    parser.add_argument("--compare", help = "compare with results stored in JSON file")
+    parser.add_argument("--threshold", type = float, default = 0.2,
+                        help = "allowed relative slowdown (default 0.2)")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("-k", dest = "select", help = "run only cases containing this string")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, func in cases().items():
+        if args.select and args.select not in name:
+            continue
+        throughput, peak = measure(func, args.repeat)
+        results[name] = {"throughput": throughput, "peak_memory": peak}
+        print("%-28s %12.1f calls/s %10s kB" % (name, throughput,
+              "-" if peak is None else "%.1f" % (peak / 1024)))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"version": crysfipy.__version__, "python": platform.python_version(),
+                       "numpy": np.__version__, "results": results}, f, indent = 2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,45 @@
 
 __version__ = '0.5'
 
-from crysfipy.cfmatrix import *
-from crysfipy.const import *
-from crysfipy.reion import *
+# Submodules are imported on the first access of their names, so that e.g.
+# ``crysfipy.const.ion`` does not pull in numpy. Names of the former star
+# imports are looked up in const, reion and cfmatrix. The star imports gave
+# precedence to reion, then const, then cfmatrix; trying the cheap const
+# first gives the same names, as reion does not shadow any of them.
+# Module level __getattr__ needs Python 3.7, so the class of the module is
+# replaced instead.
+
+import sys
+from importlib import import_module
+from types import ModuleType
+
+_SUBMODULES = ("cache", "cfmatrix", "const", "fit", "powder", "reion",
+               "scan", "spectrum", "thermo", "timing")
+_STARMODULES = ("const", "reion", "cfmatrix")
+
+def _public(module):
+    return [name for name in vars(module) if not name.startswith("_")]
+
+def _all():
+    return sorted(set().union(*(_public(import_module("crysfipy." + m))
+                                for m in _STARMODULES)))
+
+class _lazymodule(ModuleType):
+    def __getattr__(self, name):
+        if name in _SUBMODULES:
+            return import_module("crysfipy." + name)
+        if name == "__all__":
+            return _all()
+        if not name.startswith("_"):
+            for m in _STARMODULES:
+                module = import_module("crysfipy." + m)
+                if name in vars(module):
+                    value = getattr(module, name)
+                    setattr(self, name, value)
+                    return value
+        raise AttributeError("module 'crysfipy' has no attribute %r" % name)
+
+    def __dir__(self):
+        return sorted(set(vars(self)) | set(_SUBMODULES) | set(_all()))
+
+sys.modules[__name__].__class__ = _lazymodule
@@ -0,0 +1,207 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Persistent on-disk cache of diagonalized ions
+
+The cache is off by default. When enabled, every :obj:`crysfipy.reion.re`
+looks up its results by a hash of the ion name, field, Stevens parameters
+and library version before diagonalizing:
+
+    >>> import crysfipy.cache
+    >>> crysfipy.cache.enable("~/.cache/crysfipy", maxbytes = 100e6)
+
+Entries are ``.npz`` files written atomically (temporary file and rename),
+so several processes can share one directory. Least recently used entries
+are removed when the directory grows over `maxbytes`.
+
+Loading an entry takes about 1 ms, while a hamiltonian with 2J+1 <= 17
+states is diagonalized together with all derived observables in about
+0.3 ms. For such ions the cache helps only when the stored results cost
+more than loading them, e.g. when they come from an expensive sparse
+solver run or a slow shared machine.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+import numpy as np
+
+_log = logging.getLogger(__name__)
+
+# eviction leaves the entries at this fraction of maxbytes, so that the
+# following writes do not scan the directory again
+_LOWWATER = 0.9
+
+
+class diskcache:
+    """Content addressed store of arrays in a directory
+
+    The total size of the entries is kept as a running sum of the stored
+    files, the directory is scanned only when the sum exceeds `maxbytes` or
+    after every `rescan` writes, which counts in entries of other processes.
+
+    Attributes:
+        path (str): Directory of the cache.
+        maxbytes (int): Maximal total size of the entries.
+        rescan (int): Number of writes between scans of the directory.
+    """
+
+    def __init__(self, path, maxbytes = 256 * 2**20, rescan = 256):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.maxbytes = maxbytes
+        self.rescan = rescan
+        os.makedirs(self.path, exist_ok = True)
+        self.hits = 0
+        self.misses = 0
+        self._total = None      # size of the entries at the last scan + writes since
+        self._writes = 0
+
+    @staticmethod
+    def key(name, field, pars, *extra):
+        """Returns hash of the ion name, field, parameters and library version"""
+        from crysfipy import __version__
+        h = hashlib.sha256()
+        h.update(("%s|%s|" % (name.lower(), __version__)).encode())
+        h.update(np.asarray(field, float).tobytes())
+        h.update(np.asarray(pars, float).tobytes())
+        h.update(repr(extra).encode())
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".npz")
+
+    def get(self, key):
+        """Returns dictionary of arrays stored under key or None"""
+        fname = self._file(key)
+        try:
+            with np.load(fname) as f:
+                data = {name: f[name] for name in f.files}
+            os.utime(fname)      # mark as recently used
+        except OSError:
+            # not stored yet, evicted or opened by other process
+            self.misses += 1
+            return None
+        except (ValueError, EOFError, KeyError, zipfile.BadZipFile):
+            # damaged entry, e.g. truncated by a crash or full disk
+            _log.warning("crysfipy cache entry %s is damaged and was removed", key)
+            self._remove(fname)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Stores dictionary of arrays under key, returns True on success
+
+        Write errors (e.g. on Windows the entry is opened by other process,
+        full disk) are logged and the entry is skipped, the cache never
+        breaks the calculation.
+        """
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(suffix = ".tmp", dir = self.path)
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **data)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, self._file(key))
+            self._added(size)
+        except OSError as e:
+            _log.warning("crysfipy cache entry %s was not stored: %s", key, e)
+            self._remove(tmp)
+            return False
+        except BaseException:
+            self._remove(tmp)
+            raise
+        return True
+
+    @staticmethod
+    def _remove(fname):
+        if fname is not None and os.path.exists(fname):
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+
+    def entries(self):
+        """Returns list of (last use, size, file name) of all entries"""
+        ret = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".npz"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                ret.append((st.st_mtime, st.st_size, entry.path))
+        return ret
+
+    def size(self):
+        """Returns total size of the entries in bytes"""
+        return sum(e[1] for e in self.entries())
+
+    def _added(self, size):
+        """Counts new entry of given size, evicts entries above the size limit"""
+        self._writes += 1
+        if self._total is None or self._writes >= self.rescan:
+            self.evict()        # first write or sizes of other processes unknown
+        else:
+            self._total += size
+            if self._total > self.maxbytes:
+                self.evict()
+
+    def evict(self):
+        """Removes least recently used entries above the size limit
+
+        Entries are removed until they take at most 90 % of `maxbytes`.
+        """
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        if total > self.maxbytes:
+            for mtime, size, fname in entries:
+                if total <= self.maxbytes * _LOWWATER:
+                    break
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass     # already removed by other process
+                total -= size
+        self._total = total
+        self._writes = 0
+
+    def clear(self):
+        """Removes all entries"""
+        for e in self.entries():
+            try:
+                os.remove(e[2])
+            except OSError:
+                pass
+        self._total = 0
+
+
+_active = None
+
+def enable(path, maxbytes = 256 * 2**20):
+    """Enables transparent caching of :obj:`crysfipy.reion.re` results in given directory"""
+    global _active
+    _active = diskcache(path, maxbytes)
+    return _active
+
+def disable():
+    """Disables caching, stored entries are kept"""
+    global _active
+    _active = None
+
+def active():
+    """Returns enabled :obj:`diskcache` or None"""
+    return _active
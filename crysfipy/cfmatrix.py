@@ -11,7 +11,8 @@
 # GNU General Public License for more details.
 # <http://www.gnu.org/licenses/>.
 
-from numpy import diag, linspace, conj, transpose, sqrt, eye, dot
+from collections import namedtuple
+from numpy import diag, linspace, conj, transpose, sqrt, eye, dot, array
 from numpy.linalg import matrix_power as mp
 
 
@@ -168,3 +169,111 @@ def O_66(J,convention = 1):
 	return 0.5 * (mp(Jplus, 6) + mp(Jminus, 6))
 
 
+
+#: Names of the Stevens parameters in the order of the operator stack
+STEVENS = ("B20", "B22", "B40", "B42", "B44", "B60", "B62", "B64", "B66")
+
+optable = namedtuple("optable", ["O", "Jx", "Jy", "Jz"])
+optable.__doc__ = """Precomputed operators for one value of J.
+
+Attributes:
+    O (3D array of floats): Stevens operators stacked along the first axis
+        in the order given by :data:`STEVENS`, shape (9, 2J+1, 2J+1).
+    Jx, Jy, Jz (2D arrays): Components of the angular momentum operator.
+"""
+
+_opcache = {}
+
+def _readonly(a):
+    a.flags.writeable = False
+    return a
+
+def _sparse_operators(J, convention = 1):
+    """Builds :obj:`optable` of ``scipy.sparse`` CSR matrices, O is a tuple of 9 matrices"""
+    from scipy import sparse
+
+    JJ = J*(J+1)
+    J2p1 = int(2*J + 1)
+    p1 = linspace(-J,J-1,int(2*J))
+    Jz = sparse.diags(linspace(convention * J,convention * (-J),J2p1), format = "csr")
+    Jplus = sparse.diags(sqrt(J*(J+1) - p1*(p1+1)), convention, shape = (J2p1, J2p1), format = "csr")
+    Jminus = Jplus.transpose().tocsr()
+    E = sparse.identity(J2p1, format = "csr")
+
+    def pw(A, n):
+        ret = A
+        for i in range(n - 1):
+            ret = ret @ A
+        return ret
+
+    def sym(M_1, M_2):
+        return 0.25 * (M_1 @ M_2 + M_2 @ M_1)
+
+    Jz2, Jz4 = pw(Jz, 2), pw(Jz, 4)
+    P2 = pw(Jplus, 2) + pw(Jminus, 2)
+    P4 = pw(Jplus, 4) + pw(Jminus, 4)
+    O = (3 * Jz2 - JJ * E,
+         0.5 * P2,
+         35 * Jz4 + (25 - 30 * JJ) * Jz2 + E * JJ * (3 * JJ - 6),
+         sym(7 * Jz2 - E * (JJ + 5), P2),
+         0.5 * P4,
+         231 * pw(Jz, 6) + Jz4 * (735 - 315 * JJ) + Jz2 * (105*JJ**2 - 525*JJ + 294) +
+             E * (-5*JJ**3 + 40 * JJ**2 - 60*JJ),
+         sym(33 * Jz4 - Jz2 * (18 * JJ + 123) + E * (JJ**2 + 10*JJ + 102), P2),
+         sym(11 * Jz2 - E * (JJ + 38), P4),
+         0.5 * (pw(Jplus, 6) + pw(Jminus, 6)))
+    Jx = 0.5 * (Jplus + Jminus)
+    Jy = .5/1.j * (Jplus - Jminus)
+    return optable(tuple(_readonly_sparse(o) for o in O), _readonly_sparse(Jx),
+                   _readonly_sparse(Jy), _readonly_sparse(Jz))
+
+def _readonly_sparse(a):
+    a = a.tocsr()
+    a.eliminate_zeros()
+    for x in (a.data, a.indices, a.indptr):
+        x.flags.writeable = False
+    return a
+
+def _nbytes(a):
+    if hasattr(a, "nbytes"):
+        return a.nbytes
+    if isinstance(a, tuple):
+        return sum(_nbytes(x) for x in a)
+    return a.data.nbytes + a.indices.nbytes + a.indptr.nbytes
+
+def operators(J, convention = 1, sparse = False):
+    """Returns cached :obj:`optable` with all operators for given J.
+
+    Operators are built only once for every (J, convention) pair and
+    the arrays are read-only, so they can be safely shared between ions.
+
+    With ``sparse = True`` the operators are ``scipy.sparse`` CSR matrices
+    built without dense intermediates and ``O`` is a tuple of 9 matrices.
+    Stevens operators have at most 7 nonzero diagonals, so this is the
+    representation for large Hilbert spaces. Requires scipy.
+    """
+    key = (float(J), convention, "sparse") if sparse else (float(J), convention)
+    try:
+        return _opcache[key]
+    except KeyError:
+        pass
+    if sparse:
+        _opcache[key] = _sparse_operators(J, convention)
+        return _opcache[key]
+    O = array([O_20(J, convention), O_22(J, convention), O_40(J, convention),
+               O_42(J, convention), O_44(J, convention), O_60(J, convention),
+               O_62(J, convention), O_64(J, convention), O_66(J, convention)])
+    table = optable(_readonly(O),
+                    _readonly(J_x(J, convention)),
+                    _readonly(J_y(J, convention)),
+                    _readonly(J_z(J, convention)))
+    _opcache[key] = table
+    return table
+
+def operators_cache_info():
+    """Returns dictionary {(J, convention): size in bytes} of cached operators"""
+    return {key: sum(_nbytes(a) for a in t) for key, t in _opcache.items()}
+
+def operators_cache_clear():
+    """Removes all precomputed operators from the cache"""
+    _opcache.clear()
@@ -42,35 +42,99 @@ C2 = 4*pi/1e6                       # 1/chi [mol/emu] = C2 * 1/chi [mol/m3] C2 =
 
 C3 = 10/NA/uB_SI                    # = 1/C1*C2 %              1/chi [mol/emu] = C3 * 1/chi [mol/m3] C3 = 1.7905
 
+# Ion table, Stevens factors Alpha, Beta, Gamma
+_IONTABLE = (
+    # ion    J     gJ
+    ("ce", 2.5,  6.0/ 7.0,   -2.0/35.0              ,  2.0/315.0                  ,  0.0                            ),
+    ("pr", 4.0,  4.0/ 5.0,   -2.0**2*13/3**2/5**2/11, -2.0**2/3**2/5/11**2        ,  2.0**4*17/3**4/5/7/11**2/13    ),
+    ("nd", 4.5,  8.0/11.0,    7.0/1089.0            , -136.0/467181.0             , -1615.0/     42513471.0         ),
+    ("pm", 4.0,  3.0/ 5.0,    2.0*7/3/5/11**2       ,  2.0**3*7*17/3**3/5/11**3/13,  2.0**3*17*19/3**3/7/11**2/13**2),
+    ("sm", 2.5,  2.0/ 7.0,   13.0/3**2/5/7          ,  2.0*13/3**3/5/7/11         ,  0.0                            ),
+    ("tb", 6.0,  3.0/ 2.0,   -1.0/99.0              ,  2.0/        16335.0        ,  1.0/(3**4*7*11**2*13)          ),
+    ("dy", 7.5,  4.0/ 3.0,   -2.0/3**2/5/7          , -2.0**3/3**3/5/7/11/13      ,  2.0**2/3**3/7/11**2/13**2      ),
+    ("ho", 8.0,  5.0/ 4.0,   -1.0/2/3**2/5**2       , -1.0/2/3/5/7/11/13          , -5.0/3**3/7/11**2/13**3         ),
+    ("er", 7.5,  6.0/ 5.0,    4.0/(3**2*5**2*7)     ,  2.0/(3**2*5*7*11*13)       ,  8.0/(3**3*7*11**2*13)          ),
+    ("tm", 6.0,  7.0/ 6.0,    1.0/3**2/11           ,  2.0**3/3**4/5/11**2        , -5.0/3**4/7/11**2/13            ),
+    ("yb", 3.5,  8.0/ 7.0,    2.0/3**2/7            , -2.0/3/5/7/11               ,  2.0**2/3**3/7/11/13            ),
+)
+
+_INDEX = {row[0]: k for k, row in enumerate(_IONTABLE)}
+
+def _ionname(ionstr):
+    """Normalizes name of the ion, e.g. "Ce3+", " ce+3 " -> "ce" """
+    name = ionstr.strip().lower().replace(" ", "")
+    for suffix in ("3+", "+3", "+++"):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
 class ion:
-    """Ion information object"""
-
-    def __init__(self, ionstr):
-        self.name = ionstr.lower()
-        # M = [J gJ Alpha Beta Gamma]
-        M = { 
-       # ion    J     gJ
-		"ce" : [2.5,  6.0/ 7.0,   -2.0/35.0              ,  2.0/315.0                  ,  0.0                            ],
-        "pr" : [4.0,  4.0/ 5.0,   -2.0**2*13/3**2/5**2/11, -2.0**2/3**2/5/11**2        ,  2.0**4*17/3**4/5/7/11**2/13    ],
-        "nd" : [4.5,  8.0/11.0,    7.0/1089.0            , -136.0/467181.0             , -1615.0/     42513471.0         ],
-        "pm" : [4.0,  3.0/ 5.0,    2.0*7/3/5/11**2       ,  2.0**3*7*17/3**3/5/11**3/13,  2.0**3*17*19/3**3/7/11**2/13**2],
-        "sm" : [2.5,  2.0/ 7.0,   13.0/3**2/5/7          ,  2.0*13/3**3/5/7/11         ,  0.0                            ],
-        "tb" : [6.0,  3.0/ 2.0,   -1.0/99.0              ,  2.0/        16335.0        ,  1.0/(3**4*7*11**2*13)          ],
-        "dy" : [7.5,  4.0/ 3.0,   -2.0/3**2/5/7          , -2.0**3/3**3/5/7/11/13      ,  2.0**2/3**3/7/11**2/13**2      ],
-        "ho" : [8.0,  5.0/ 4.0,   -1.0/2/3**2/5**2       , -1.0/2/3/5/7/11/13          , -5.0/3**3/7/11**2/13**3         ],
-        "er" : [7.5,  6.0/ 5.0,    4.0/(3**2*5**2*7)     ,  2.0/(3**2*5*7*11*13)       ,  8.0/(3**3*7*11**2*13)          ],
-        "tm" : [6.0,  7.0/ 6.0,    1.0/3**2/11           ,  2.0**3/3**4/5/11**2	       , -5.0/3**4/7/11**2/13            ],
-        "yb" : [3.5,  8.0/ 7.0,    2.0/3**2/7            , -2.0/3/5/7/11               ,  2.0**2/3**3/7/11/13            ],
-        }[self.name]
-
-        self.J     = M[0]
-        self.J2p1  = int(2 * M[0] + 1)
-        self.gJ    = M[1]
-        self.Alpha = M[2]
-        self.Beta  = M[3]
-        self.Gamma = M[4]
+    """Ion information object
+
+    Instances are immutable and shared, ``ion("Ho") is ion("ho3+")``.
+    Name is case-insensitive and may contain the charge, e.g. "Ce3+".
+
+    Attributes:
+        name (str): Lowercase name of the element.
+        J (float): Total angular momentum.
+        J2p1 (int): Dimension 2J+1 of the multiplet.
+        gJ (float): Landé g-factor.
+        Alpha, Beta, Gamma (float): Stevens factors.
+    """
+
+    __slots__ = ("name", "J", "J2p1", "gJ", "Alpha", "Beta", "Gamma")
+    _instances = {}
+
+    def __new__(cls, ionstr):
+        try:
+            return cls._instances[ionstr]
+        except KeyError:
+            pass
+        name = _ionname(ionstr)
+        if name not in _INDEX:
+            raise KeyError("Unknown ion %s" % ionstr)
+        self = cls._instances.get(name)
+        if self is None:
+            self = object.__new__(cls)
+            row = _IONTABLE[_INDEX[name]]
+            for attr, value in zip(("name", "J", "gJ", "Alpha", "Beta", "Gamma"), row):
+                object.__setattr__(self, attr, value)
+            object.__setattr__(self, "J2p1", int(2 * row[1] + 1))
+            cls._instances[name] = self
+        cls._instances[ionstr] = self
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ion is immutable")
+
+    def __reduce__(self):
+        return (ion, (self.name,))
+
+    def __repr__(self):
+        return "ion(%r)" % self.name
 
     def __str__(self):
         return "%s3+: J = %d, gJ = %.2f" % (self.name.title(), self.J, self.gJ)
 
 
+def ions():
+    """Returns tuple of all ions in the table"""
+    return tuple(ion(row[0]) for row in _IONTABLE)
+
+_iontable = None
+
+def iontable():
+    """Returns the ion table as read-only structured NumPy array
+
+    Fields are ``name``, ``J``, ``J2p1``, ``gJ``, ``Alpha``, ``Beta`` and
+    ``Gamma``, so e.g. ``iontable()["gJ"]`` are g-factors of all ions.
+    """
+    global _iontable
+    if _iontable is None:
+        import numpy as np
+        dtype = [("name", "U2"), ("J", float), ("J2p1", int), ("gJ", float),
+                 ("Alpha", float), ("Beta", float), ("Gamma", float)]
+        _iontable = np.array([(r[0], r[1], int(2 * r[1] + 1)) + r[2:] for r in _IONTABLE], dtype)
+        _iontable.flags.writeable = False
+    return _iontable
@@ -0,0 +1,315 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Fitting of CF parameters to susceptibility, magnetization and INS data
+
+Residuals and their Jacobians are evaluated analytically (see
+:func:`crysfipy.reion.susceptibility_jacobian` etc.) and minimized by
+Levenberg-Marquardt algorithm.
+"""
+
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+
+from crysfipy.cfmatrix import STEVENS
+from crysfipy.reion import re, cfpars, susceptibility, susceptibility_jacobian, \
+    neutronint, neutronint_jacobian, _jumps
+
+
+class chidata:
+    """Susceptibility measured as function of temperature
+
+    Attributes:
+        T (1D array of floats): temperatures in *K*
+        chi (1D array of floats): measured susceptibility in *uB/T*
+        field (1D array of floats): field vector used for the measurement in *T*
+        weight (float or 1D array of floats): weights of the points (e.g. 1/sigma)
+    """
+
+    def __init__(self, T, chi, field = [0, 0, 0.1], weight = 1):
+        self.T = np.asarray(T, float)
+        self.data = np.asarray(chi, float)
+        self.field = field
+        self.weight = weight
+
+    def fields(self):
+        return [self.field]
+
+    def model(self, ions):
+        ion = ions[0]
+        return susceptibility(ion, self.T), susceptibility_jacobian(ion, self.T)
+
+
+class magdata:
+    """Magnetization measured as function of field at one temperature
+
+    Attributes:
+        H (1D array of floats): sizes of the field in *T*
+        M (1D array of floats): measured magnetization in *uB* per ion
+        T (float): temperature in *K*
+        direction (1D array of floats): direction of the field
+        weight (float or 1D array of floats): weights of the points
+    """
+
+    def __init__(self, H, M, T, direction = [0, 0, 1], weight = 1):
+        self.H = np.asarray(H, float)
+        self.data = np.asarray(M, float)
+        self.T = T
+        d = np.asarray(direction, float)
+        self.direction = d / np.sqrt(np.dot(d, d))
+        self.weight = weight
+
+    def fields(self):
+        return [self.direction * h for h in self.H]
+
+    def model(self, ions):
+        M = np.zeros(len(self.H))
+        dM = np.zeros((len(self.H), len(STEVENS)))
+        for k, (ion, h) in enumerate(zip(ions, self.H)):
+            if h != 0:      # no induced moment and no direction in zero field
+                M[k] = susceptibility(ion, self.T) * h
+                dM[k] = susceptibility_jacobian(ion, self.T) * h
+        return M, dM
+
+
+class insdata:
+    """Energies (and optionally relative intensities) of INS peaks
+
+    Peaks are matched to transitions from the ground state to the excited
+    levels in order of increasing energy. The model raises ValueError if
+    there are more peaks than excited levels.
+
+    Attributes:
+        energies (1D array of floats): measured energies of the peaks
+        intensities (1D array of floats, optional): measured intensities, they are
+            compared relatively to the first peak
+        T (float): temperature in *K* used for intensities
+        direction (str): Direction of Q, see :func:`crysfipy.reion.neutronint`
+        weight (float or 1D array of floats): weights of the points
+    """
+
+    def __init__(self, energies, intensities = None, T = 2, direction = "t", weight = 1):
+        self.energies = np.asarray(energies, float)
+        self.intensities = None if intensities is None else np.asarray(intensities, float)
+        self.data = self.energies
+        if self.intensities is not None:
+            self.data = np.concatenate((self.energies, self.intensities / self.intensities[0]))
+        self.T = T
+        self.direction = direction
+        self.weight = weight
+
+    def fields(self):
+        return [[0, 0, 0]]
+
+    def model(self, ions):
+        ion = ions[0]
+        n = len(self.energies)
+        if n > len(ion.deg_e) - 1:
+            raise ValueError("%d INS peaks but only %d excited levels of %s"
+                             % (n, len(ion.deg_e) - 1, ion.name))
+        levels = np.arange(1, n + 1)
+        starts = ion._starts[levels]
+        E = ion.deg_e[levels, 0]
+        dE = ion.energy_jacobian()[starts]
+        if self.intensities is None:
+            return E, dE
+        # transitions from the ground level in the order of neutronint
+        jumps, order = _jumps(ion)
+        pos = np.argsort(order)[levels]
+        I = neutronint(ion, self.T, self.direction)[1][pos]
+        dI = neutronint_jacobian(ion, self.T, self.direction)[1][pos]
+        # intensities relative to the first peak
+        dI = dI / I[0] - I[:, np.newaxis] * dI[0] / I[0]**2
+        return np.concatenate((E, I / I[0])), np.concatenate((dE, dI))
+
+
+class fitresult:
+    """Result of :func:`fit`
+
+    Attributes:
+        cfp (:obj:`crysfipy.reion.cfpars`): Fitted CF parameters
+        x (1D array of floats): Fitted values of free parameters
+        free (list of str): Names of the free parameters
+        cost (float): Half of the sum of squared weighted residuals
+        residuals (1D array of floats): Weighted residuals
+        jac (2D array of floats): Jacobian of the residuals
+        success (bool): True if one of the convergence criteria was met
+        message (str): Reason of termination
+        nfev (int): Number of model evaluations (cache hits are not counted)
+        history (list of dict): Per-iteration record with cost, damping and
+            timing of model evaluation and linear solution in seconds
+    """
+
+    def __str__(self):
+        ret = "Fit %s after %d iterations, cost = %.6g\n" % (
+            "converged" if self.success else "stopped", len(self.history), self.cost)
+        ret += str(self.cfp)
+        return ret
+
+
+class _model:
+    """Memoized evaluation of weighted residuals and their Jacobian"""
+
+    def __init__(self, name, cfp, free, data, cachesize):
+        self.data = data
+        self.sym = cfp.sym
+        self.free = list(free)
+        self.base = np.array([getattr(cfp, n) for n in STEVENS], float)
+        # linear map of free parameters to all Stevens parameters
+        self.M = np.zeros((len(STEVENS), len(self.free)))
+        for k, n in enumerate(self.free):
+            self.M[STEVENS.index(n), k] = 1
+            if self.sym == "c" and n == "B40":
+                self.M[STEVENS.index("B44"), k] = 5
+            if self.sym == "c" and n == "B60":
+                self.M[STEVENS.index("B64"), k] = -21
+        self.x0 = self.base[[STEVENS.index(n) for n in self.free]]
+        self.base = self.base - self.M @ self.x0
+        # one ion for every field, parameters are then only updated
+        self.ions = {}
+        for d in data:
+            for f in d.fields():
+                key = tuple(np.asarray(f, float))
+                if key not in self.ions:
+                    self.ions[key] = re(name, f, cfpars(self.sym), calculate = False)
+        self.cache = OrderedDict()
+        self.cachesize = cachesize
+        self.nfev = 0
+        self.hits = 0
+
+    def pars(self, x):
+        return self.base + self.M @ x
+
+    def __call__(self, x):
+        key = np.asarray(x, float).tobytes()
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.nfev += 1
+        P = self.pars(x)
+        for ion in self.ions.values():
+            for n, value in zip(STEVENS, P):
+                ion.setpar(n, value)
+        res, jac = [], []
+        for d in self.data:
+            ions = [self.ions[tuple(np.asarray(f, float))] for f in d.fields()]
+            y, dy = d.model(ions)
+            w = np.broadcast_to(np.asarray(d.weight, float), np.shape(d.data))
+            res.append(w * (y - d.data))
+            jac.append(w[:, np.newaxis] * (dy @ self.M))
+        value = (np.concatenate(res), np.concatenate(jac))
+        self.cache[key] = value
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last = False)
+        return value
+
+
+def fit(name, cfp, data, free = None, max_iter = 100, ftol = 1e-10, xtol = 1e-10,
+        gtol = 1e-10, callback = None, cachesize = 128):
+    """Fits CF parameters to experimental data
+
+    Args:
+        name (str): Name of the ion.
+        cfp (:obj:`crysfipy.reion.cfpars` or list): Initial CF parameters, their
+            symmetry defines which parameters are fitted.
+        data (list): Datasets, see :obj:`chidata`, :obj:`magdata` and :obj:`insdata`.
+        free (list of str, optional): Names of fitted parameters, default are all
+            independent parameters of the symmetry.
+        max_iter (int): Maximal number of iterations.
+        ftol, xtol, gtol (float): Tolerances for relative change of the cost,
+            relative size of the step and size of the gradient.
+        callback (callable, optional): Called after every iteration with
+            :obj:`fitresult` of the current state, the fit stops when it
+            returns True.
+        cachesize (int): Number of memoized model evaluations.
+
+    Returns:
+        :obj:`fitresult`
+
+    Examples:
+
+        >>> r = fit("Ho", ["t", -0.17, 0.001], [chidata(T, chi, [0, 0, 1]), insdata([5.5, 6.3])])
+        >>> print(r.cfp)
+    """
+    if type(cfp) is list:
+        cfp = cfpars(*cfp)
+    if free is None:
+        free = [n for n in cfpars.pars[cfp.sym][1]
+                if not (cfp.sym == "c" and n in ("B44", "B64"))]
+    model = _model(name, cfp, free, data, cachesize)
+
+    def state(x, r, J, success, message):
+        res = fitresult()
+        res.cfp = cfpars(cfp.sym)
+        for n, value in zip(STEVENS, model.pars(x)):
+            res.cfp._asignParameter(n, value)
+        res.x, res.free = x, model.free
+        res.residuals, res.jac = r, J
+        res.cost = 0.5 * np.dot(r, r)
+        res.success, res.message = success, message
+        res.nfev, res.cachehits = model.nfev, model.hits
+        res.history = history
+        return res
+
+    history = []
+    x = model.x0.copy()
+    r, J = model(x)
+    cost = 0.5 * np.dot(r, r)
+    lam = None
+    message, success = "maximal number of iterations reached", False
+    for it in range(max_iter):
+        t0 = perf_counter()
+        g = J.T @ r
+        if np.max(np.abs(g)) <= gtol:
+            message, success = "gradient is small", True
+            break
+        A = J.T @ J
+        D = np.maximum(np.diag(A), 1e-30)
+        if lam is None:
+            lam = 1e-3
+        tmodel = tsolve = 0
+        while True:
+            t1 = perf_counter()
+            dx = np.linalg.solve(A + lam * np.diag(D), -g)
+            t2 = perf_counter()
+            xn = x + dx
+            rn, Jn = model(xn)
+            t3 = perf_counter()
+            tsolve += t2 - t1
+            tmodel += t3 - t2
+            costn = 0.5 * np.dot(rn, rn)
+            if costn < cost or lam > 1e16:
+                break
+            lam *= 4
+        step = np.sqrt(np.dot(dx, dx))
+        improvement = cost - costn
+        if costn < cost:
+            x, r, J, cost = xn, rn, Jn, costn
+            lam = max(lam / 3, 1e-12)
+        history.append({"iteration": it, "cost": cost, "lambda": lam,
+                        "model": tmodel, "solve": tsolve, "total": perf_counter() - t0})
+        if improvement < 0:
+            message, success = "cost can not be decreased", True
+            break
+        if improvement <= ftol * cost:
+            message, success = "relative change of the cost is small", True
+            break
+        if step <= xtol * (np.sqrt(np.dot(x, x)) + xtol):
+            message, success = "step is small", True
+            break
+        if callback is not None and callback(state(x, r, J, False, "running")):
+            message, success = "stopped by callback", False
+            break
+    return state(x, r, J, success, message)
@@ -0,0 +1,192 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Powder averaging over field directions using spherical quadratures"""
+
+from itertools import permutations, product
+import numpy as np
+
+from crysfipy.cfmatrix import STEVENS
+from crysfipy.reion import magnetization
+
+# Lebedev grids: degree -> list of (generator, parameters, weight)
+_LEBEDEV = {
+    3: [("a1", (), 1.0 / 6)],
+    5: [("a1", (), 1.0 / 15), ("a3", (), 3.0 / 40)],
+    7: [("a1", (), 1.0 / 21), ("a2", (), 4.0 / 105), ("a3", (), 9.0 / 280)],
+    9: [("a1", (), 1.0 / 105), ("a3", (), 9.0 / 280),
+        ("c", (0.4597008433809831,), 1.0 / 35)],
+    11: [("a1", (), 4.0 / 315), ("a2", (), 64.0 / 2835), ("a3", (), 27.0 / 1280),
+         ("b", (1 / np.sqrt(11),), 14641.0 / 725760)],
+}
+
+def _orbit(v):
+    """All distinct points obtained by permutations and sign changes of v"""
+    pts = {tuple(s * x for s, x in zip(signs, p))
+           for p in permutations(v) for signs in product((1, -1), repeat = 3)}
+    return np.array(sorted(pts))
+
+def _lebedev(degree):
+    points, weights = [], []
+    for gen, par, w in _LEBEDEV[degree]:
+        if gen == "a1":
+            v = (1.0, 0.0, 0.0)
+        elif gen == "a2":
+            v = (np.sqrt(0.5), np.sqrt(0.5), 0.0)
+        elif gen == "a3":
+            v = (np.sqrt(1.0 / 3),) * 3
+        elif gen == "b":
+            v = (par[0], par[0], np.sqrt(1 - 2 * par[0]**2))
+        else:
+            v = (par[0], np.sqrt(1 - par[0]**2), 0.0)
+        p = _orbit(v)
+        points.append(p)
+        weights.append(np.full(len(p), w))
+    return np.concatenate(points), np.concatenate(weights)
+
+def _gauss(order):
+    """Product of Gauss-Legendre in cos(theta) and uniform grid in phi"""
+    x, w = np.polynomial.legendre.leggauss(order)
+    phi = np.arange(2 * order) * np.pi / order
+    st = np.sqrt(1 - x * x)
+    points = np.stack([np.outer(st, np.cos(phi)), np.outer(st, np.sin(phi)),
+                       np.outer(x, np.ones_like(phi))], axis = -1).reshape(-1, 3)
+    weights = np.outer(w, np.ones_like(phi)).ravel()
+    return points, weights / np.sum(weights)
+
+_quadcache = {}
+
+def quadrature(order = 11, method = "lebedev"):
+    """Returns cached spherical quadrature (points, weights)
+
+    Args:
+        order (int): For Lebedev grids the degree of polynomials integrated
+            exactly (3, 5, 7, 9, 11). For Gauss grids the number of nodes
+            in cos(theta), polynomials up to degree 2*order-1 are exact.
+        method (str): "lebedev" or "gauss"
+
+    Returns:
+        Read-only arrays of unit vectors (n, 3) and weights (n,) summing to one.
+    """
+    key = (method, order)
+    try:
+        return _quadcache[key]
+    except KeyError:
+        pass
+    if method == "lebedev":
+        if order not in _LEBEDEV:
+            raise ValueError("Lebedev grid of degree %d is not available, use one of %s"
+                             % (order, sorted(_LEBEDEV)))
+        points, weights = _lebedev(order)
+    elif method == "gauss":
+        points, weights = _gauss(order)
+    else:
+        raise ValueError("Unknown quadrature %s" % method)
+    points.flags.writeable = False
+    weights.flags.writeable = False
+    _quadcache[key] = (points, weights)
+    return _quadcache[key]
+
+def quadrature_cache_info():
+    """Returns dictionary {(method, order): number of points} of cached grids"""
+    return {key: len(q[0]) for key, q in _quadcache.items()}
+
+def quadrature_cache_clear():
+    """Removes all cached quadrature grids"""
+    _quadcache.clear()
+
+
+def _rotz(n):
+    c, s = np.cos(2 * np.pi / n), np.sin(2 * np.pi / n)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+def _group(generators):
+    """Closure of the group generated by given 3x3 matrices"""
+    group = [np.eye(3)]
+    new = list(group)
+    while new:
+        found = []
+        for g in new:
+            for h in generators:
+                m = np.round(h @ g, 12)
+                if not any(np.allclose(m, x) for x in group + found):
+                    found.append(m)
+        group += found
+        new = found
+    return np.array(group)
+
+def symmetry(pars):
+    """Returns symmetry of the field directions for given Stevens parameters
+
+    Result is one of "c", "t", "h", "o" (see :obj:`crysfipy.reion.cfpars`) or
+    "u" for uniaxial case with only :math:`B_k^0` parameters.
+    """
+    B = dict(zip(STEVENS, np.asarray(pars, float)))
+    q = {int(n[2]) for n, v in B.items() if v != 0}
+    if q <= {0}:
+        return "u"
+    if q <= {0, 4}:
+        if B["B20"] == 0 and np.isclose(B["B44"], 5 * B["B40"], atol = 0) and \
+                np.isclose(B["B64"], -21 * B["B60"], atol = 0):
+            return "c"
+        return "t"
+    if q <= {0, 6}:
+        return "h"
+    return "o"
+
+def operations(sym):
+    """Returns symmetry operations acting on field direction for given symmetry
+
+    Real Stevens parameters with even q are invariant to two-fold rotations
+    around x, y and z, and time reversal makes observables along the field
+    even in the field, so all sign changes of the components are included.
+    """
+    gens = [np.diag([-1.0, 1, 1]), np.diag([1.0, -1, 1]), np.diag([1.0, 1, -1])]
+    if sym in ("t", "c", "u"):
+        gens.append(_rotz(4))
+    if sym in ("h", "u"):
+        gens.append(_rotz(6))
+    if sym == "c":
+        gens.append(np.array([[0.0, 0, 1], [1, 0, 0], [0, 1, 0]]))
+    return _group(gens)
+
+def reduce(points, weights, sym):
+    """Merges quadrature points equivalent by symmetry
+
+    Returns representative points and summed weights.
+    """
+    ops = operations(sym)
+    images = np.round(np.einsum("gij,nj->gni", ops, points), 9) + 0.0
+    unique, ids = np.unique(images.reshape(-1, 3), axis = 0, return_inverse = True)
+    # representative is the lexicographically largest image
+    canon = np.max(ids.reshape(len(ops), len(points)), axis = 0)
+    keys, inverse = np.unique(canon, return_inverse = True)
+    return unique[keys], np.bincount(inverse.ravel(), weights = weights)
+
+def directions(ion, order = 11, method = "lebedev"):
+    """Returns symmetry reduced quadrature (points, weights) for given ion"""
+    points, weights = quadrature(order, method)
+    return reduce(points, weights, symmetry(ion._pars))
+
+def powder_magnetization(ion, H, T, order = 11, method = "lebedev"):
+    """Returns powder averaged magnetization with shape (nH, nT) in *uB* per ion
+
+    All symmetry independent directions are evaluated in one batched
+    calculation by :func:`crysfipy.reion.magnetization`.
+    """
+    points, weights = directions(ion, order, method)
+    return magnetization(ion, H, T, points, weights)
+
+def powder_susceptibility(ion, T, H = 0.01, order = 11, method = "lebedev"):
+    """Returns powder averaged susceptibility in *uB/T* calculated in field H"""
+    return powder_magnetization(ion, [H], T, order, method)[0] / H
@@ -15,10 +15,36 @@
 import crysfipy.const as C
 from crysfipy.const import ion
 from crysfipy.cfmatrix import *
+import crysfipy.cache as _diskcache
+import crysfipy.timing as _timing
+from crysfipy.timing import profile
 import numpy as np
-from numpy import diag, conj, transpose, dot
-from numpy.linalg import eig
+from numpy import conj, transpose, dot
+from numpy.linalg import eigh, eigvalsh
 import numbers
+from math import gcd
+
+
+class _cached_property:
+    """Attribute calculated by the method on the first access
+
+    It is a non-data descriptor, the value is stored in the instance
+    ``__dict__`` and shadows the descriptor until it is removed from there
+    (see :meth:`re._invalidate`). Replaces :obj:`functools.cached_property`
+    which is not available before Python 3.8.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls = None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.name] = self.func(obj)
+        return value
+
 
 class cfpars:
     """Class representing set of crystal field parameters.
@@ -155,6 +181,20 @@ class re:
         cfp (:obj:`crysfipy.reion.cfpars`): Crystal field parameters
         calculate (bool, optional): If true (default) then it automatically diagonalizes
             Hamiltonian and calculates energy levels.
+        eigvals_only (bool, optional): If true, only energy levels and their degeneracies
+            are calculated. Eigenvectors, moments and transition matrices are skipped.
+        rtol, atol (float, optional): Relative and absolute tolerance used to decide
+            whether two levels are degenerate, see :func:`numpy.isclose`.
+        solver (str, optional): Method of diagonalization
+
+            | auto - block solver for large matrices which split into blocks (default)
+            | block - diagonalize independent blocks of states :math:`|M\\rangle`
+              coupled by the CF parameters, falls back to dense if there are none
+            | dense - diagonalize the full matrix
+            | sparse - iterative solver for `k` lowest states using sparse operators
+              (requires scipy), observables are then restricted to these states
+        k (int, optional): Number of the lowest states calculated by the sparse solver.
+            It should not split a degenerate level. Default None calculates all of them.
 
     Examples:
         
@@ -165,77 +205,231 @@ class re:
         E(1) =	3600.0000	 4fold-degenerated
     """
 
-    def __init__(self, name, field, cfp, calculate = True):
+    _levelattrs = ("rawenergy", "energy", "deg_e", "rawev", "ev", "moment",
+                   "Jx", "Jy", "Jz", "Jx2", "Jy2", "Jz2",
+                   "deg_Jx2", "deg_Jy2", "deg_Jz2", "deg_Jt2", "_starts", "_labels", "_O")
+
+    def __init__(self, name, field, cfp, calculate = True, eigvals_only = False, 
+                 rtol = 1e-5, atol = 1e-8, solver = "auto", k = None):
         self.name = name
-        self.field = field
+        self.eigvals_only = eigvals_only
+        self.solver = solver
+        self.k = k
+        self.rtol = rtol
+        self.atol = atol
         if type(cfp) is list:
             cfp = cfpars(*cfp)
         self.cfp = cfp
         
+        i = ion(self.name)
+        self.J = i.J
+        self.gJ = i.gJ
+        self.p1 = np.ones((i.J2p1,1), float);      # column vector of ones
+        # sparse solver never builds dense (2J+1)^2 operators
+        self._ops = operators(i.J, sparse = solver == "sparse")
+        self.setfield(field)
+        if (calculate):
+            self.getlevels()      # assembles the CF part too
+        else:
+            self._setcfp()
+
+    def _setcfp(self):
+        """Assembles the CF part of the hamiltonian from :attr:`cfp`"""
+        # zero-field CF part of the hamiltonian is kept separately from the Zeeman part
+        self._pars = np.array([getattr(self.cfp, name) for name in STEVENS], float)
+        O = self._ops.O
+        if isinstance(O, tuple):     # sparse operators
+            self._Hcf = self._ops.Jz * 0
+            for p, Ok in zip(self._pars, O):
+                if p != 0:
+                    self._Hcf = self._Hcf + p * Ok
+        else:
+            self._Hcf = np.tensordot(self._pars, O, axes = 1)
+
+    def _invalidate(self):
+        """Drops calculated levels, they are recalculated when needed"""
+        for name in re._levelattrs:
+            self.__dict__.pop(name, None)
+
+    @property
+    def hamiltonian(self):
+        """Hamiltonian matrix including the Zeeman term, ``scipy.sparse`` for sparse solver"""
+        return self._Hcf + self._Hz
+
+    def setpar(self, name, value):
+        """Changes one Stevens parameter, e.g. ``ion.setpar("B40", 0.1)``.
+
+        Only the difference of the corresponding operator is added to the
+        hamiltonian, levels are recalculated on the next access. Symmetry
+        constrains of :obj:`cfpars` are not applied.
+        """
+        k = STEVENS.index(name)
+        delta = value - self._pars[k]
+        if delta != 0:
+            self._Hcf += delta * self._ops.O[k]
+            self._pars[k] = value
+            setattr(self.cfp, name, value)
+            self._invalidate()
+
+    def setfield(self, field):
+        """Changes external magnetic field, levels are recalculated on the next access"""
+        self.field = field
         self.H = np.array(field)
         self.H_size = np.sqrt(dot(self.H, self.H.conj().transpose()))
         if self.H_size > 0:
             self.H_direction = self.H / self.H_size
-        if (calculate):
-            self.getlevels()
-    
-    
+        else:
+            self.__dict__.pop("H_direction", None)
+        self._Hz = C.uB * self.gJ * _Jdot(self._ops, self.H)
+        self._invalidate()
     
+    @_timing.timed("re.getlevels")
     def getlevels(self):
-        """Calculate degeneracy of the levels and sort the matrix"""
+        """Diagonalize the hamiltonian and calculate degeneracy of the levels
+
+        CF parameters are read again from :attr:`cfp`, so changes made
+        directly to it are taken into account. Other observables (eigenbasis
+        matrices, moments, transition matrices) are calculated on the first
+        access and cached until parameters change.
+        """
 
+        self._setcfp()
+        self._invalidate()
+        return self.deg_e
+
+    @_cached_property
+    def rawenergy(self):
+        """Energy levels sorted from the lowest one"""
         self._calculate()
-        #orthogonalization not needed?
-        #self.rawev,R = np.linalg.qr(self.rawev)
-        
-        #change the sign to be positive :)
-        self.rawev = self.rawev * np.sign(np.sum(self.rawev, axis=0))
-
-        self.energy = self.rawenergy - min(self.rawenergy)     # shift to zero level	
-        #sorting
-        self.ev = self.rawev[:,self.rawenergy.argsort()]
-        self.energy = np.sort(self.energy)
-        #get sorted Jx,Jz and Jz 
-        self.Jz = dot(dot(self.ev.conj().transpose(), J_z(self.J)), self.ev)
-        self.Jx = dot(dot(self.ev.conj().transpose(), J_x(self.J)), self.ev)
-        self.Jy = dot(dot(self.ev.conj().transpose(), J_y(self.J)), self.ev)
-        #calculate J^2 matrices
-        self.Jx2 = np.square(np.abs(self.Jx))
-        self.Jy2 = np.square(np.abs(self.Jy))
-        self.Jz2 = np.square(np.abs(self.Jz))
+        return self.__dict__["rawenergy"]
 
-        #calculate degeneracy
-        deg_e = []
-        levels = 0
-        deg_e.append([self.energy[0], 0])
-        for x in self.energy:
-            if not np.isclose(deg_e[levels][0], x):
-                levels+=1
-                deg_e.append([x, 1])
-            else:
-                deg_e[levels][1] += 1
-        
-        levels += 1  # started at zero
-        
-        #empty degenerate level transition matrices
-        self.deg_Jx2 = np.zeros((levels,levels))
-        self.deg_Jy2 = np.zeros((levels,levels))
-        self.deg_Jz2 = np.zeros((levels,levels))
-        #sum degenerated levels
-        u = 0
-        v = 0
-        for i, x in enumerate(deg_e):
-            v = 0
-            for j, y in enumerate(deg_e):
-                self.deg_Jx2[i,j] = np.sum(self.Jx2[u:u+x[1],v:v+y[1]])
-                self.deg_Jy2[i,j] = np.sum(self.Jy2[u:u+x[1],v:v+y[1]])
-                self.deg_Jz2[i,j] = np.sum(self.Jz2[u:u+x[1],v:v+y[1]])
-                v+=y[1]
-            u+=x[1]        
-            
-        #calculate Jt2 for polycrystal
-        self.deg_Jt2 = 2.0 / 3 * (self.deg_Jx2 + self.deg_Jy2 + self.deg_Jz2)
-        self.deg_e = np.array(deg_e)   
+    @_cached_property
+    def rawev(self):
+        """Eigenvectors, columns correspond to :attr:`rawenergy`"""
+        if self.eigvals_only:
+            raise AttributeError("eigenvectors are not calculated with eigvals_only")
+        self._calculate()
+        return self.__dict__["rawev"]
+
+    @_cached_property
+    def energy(self):
+        """Energy levels shifted to the ground state"""
+        return self.rawenergy - self.rawenergy[0]     # shift to zero level
+
+    @_cached_property
+    def ev(self):
+        """Eigenvectors sorted by energy"""
+        # eigenvalues from eigh are already sorted
+        return self.rawev
+
+    @_timing.timed("re.transform")
+    def _transform(self, A):
+        """Converts matrix to the basis of eigenvectors"""
+        return self.ev.conj().transpose() @ (A @ self.ev)   # it is then easier to calculate <i|J|j>
+
+    @_cached_property
+    def Jx(self):
+        return self._transform(self._ops.Jx)
+
+    @_cached_property
+    def Jy(self):
+        return self._transform(self._ops.Jy)
+
+    @_cached_property
+    def Jz(self):
+        return self._transform(self._ops.Jz)
+
+    @_cached_property
+    @_timing.timed("re.transform")
+    def moment(self):
+        """Projections of moments to x, y, z directions for all levels"""
+        U = self.ev
+        ops = self._ops
+        # only diagonal elements <i|J|i> are needed, full transformation is skipped
+        return - self.gJ * np.real(np.stack([
+            np.sum(U.conj() * (ops.Jx @ U), axis = 0),
+            np.sum(U.conj() * (ops.Jy @ U), axis = 0),
+            np.sum(U.conj() * (ops.Jz @ U), axis = 0)], axis = -1))
+
+    @_cached_property
+    def Jx2(self):
+        return np.square(np.abs(self.Jx))
+
+    @_cached_property
+    def Jy2(self):
+        return np.square(np.abs(self.Jy))
+
+    @_cached_property
+    def Jz2(self):
+        return np.square(np.abs(self.Jz))
+
+    @_cached_property
+    @_timing.timed("re.degeneracy")
+    def _starts(self):
+        """Indices of the first state of every degenerate level"""
+        return np.nonzero(_degeneracy(self.energy, self.rtol, self.atol)[1])[0]
+
+    @_cached_property
+    def deg_e(self):
+        """Energies of the degenerate levels (first column) and their degeneracies (second column)"""
+        starts = self._starts
+        return np.column_stack((self.energy[starts], np.diff(np.append(starts, len(self.energy)))))
+
+    @_timing.timed("re.degeneracy")
+    def _blocksum(self, X2):
+        """Sums the matrix over the blocks of degenerate levels"""
+        return np.add.reduceat(np.add.reduceat(X2, self._starts, axis = 0), self._starts, axis = 1)
+
+    @_cached_property
+    def deg_Jx2(self):
+        return self._blocksum(self.Jx2)
+
+    @_cached_property
+    def deg_Jy2(self):
+        return self._blocksum(self.Jy2)
+
+    @_cached_property
+    def deg_Jz2(self):
+        return self._blocksum(self.Jz2)
+
+    @_cached_property
+    def deg_Jt2(self):
+        """Transition matrix for polycrystal"""
+        return 2.0 / 3 * (self.deg_Jx2 + self.deg_Jy2 + self.deg_Jz2)
+
+    @_cached_property
+    def _labels(self):
+        """Index of the degenerate level for every state"""
+        return np.repeat(np.arange(len(self._starts)), self.deg_e[:,1].astype(int))
+
+    @_cached_property
+    @_timing.timed("re.transform")
+    def _O(self):
+        """Stevens operators in the basis of eigenvectors, shape (9, 2J+1, 2J+1)"""
+        O = self._ops.O
+        if isinstance(O, tuple):     # sparse operators
+            return np.array([self._transform(Ok) for Ok in O])
+        return self.ev.conj().transpose() @ O @ self.ev
+
+    def _levelmean(self, d):
+        """Averages the last axis of d over degenerate levels"""
+        deg = self.deg_e[:,1].astype(int)
+        return np.repeat(np.add.reduceat(d, self._starts, axis = -1) / deg, deg, axis = -1)
+
+    def energy_jacobian(self):
+        """Returns derivatives of :attr:`energy` with respect to Stevens parameters
+
+        Derivatives are given by the first order perturbation theory,
+        :math:`\\partial E_n / \\partial B_k = \\langle n|O_k|n \\rangle`. For
+        degenerate levels the derivative of the mean energy of the level is used.
+        As energies are shifted to the ground state, its derivative is subtracted.
+        Returns array with shape (2J+1, 9), columns follow
+        :data:`crysfipy.cfmatrix.STEVENS`.
+        """
+        U = self.ev
+        d = np.real(np.array([np.sum(U.conj() * (Ok @ U), axis = 0) for Ok in self._ops.O]))
+        d = self._levelmean(d)
+        return (d - d[:, :1]).T
         
     def __str__(self):
         """Nice printout of calculated parameters"""
@@ -245,51 +439,289 @@ class re:
             ret += "E({:d}) =\t{:.4f}\t{:2d}fold-degenerated\n".format(i, x[0], int(x[1]))
         return ret
       
+    def _blocks(self):
+        """Returns list of indices of independent blocks of the hamiltonian or None"""
+        n = len(self.p1)
+        if self.solver in ("dense", "sparse") or (self.solver == "auto" and n < _BLOCK_MIN):
+            return None
+        return _blocks(self._pars, self.H, n)
+
+    def _sparse(self):
+        """True if the sparse solver calculates only part of the states"""
+        return self.solver == "sparse" and self.k is not None and self.k < len(self.p1) - 1
+
+    #: Attributes stored in the on-disk cache, see :mod:`crysfipy.cache`
+    _cachedattrs = ("rawenergy", "rawev", "moment", "deg_e", "_starts",
+                    "deg_Jx2", "deg_Jy2", "deg_Jz2")
+
+    @_timing.timed("re._calculate")
     def _calculate(self):
         """Calculates energy splitting in CF potential"""
 
-        i = ion(self.name)
-        self.J = i.J
-        self.p1 = np.ones((i.J2p1,1), float);      # column vector of ones
-        self.Jx = J_x(i.J); 
-        self.Jy = J_y(i.J);
-        self.Jz = J_z(i.J);                        # prepare matrices
-        self.gJ = i.gJ
-        self.moment = np.zeros((i.J2p1,3), float)  # matrix with projection of moments to x, y, z directions for all J2p1 levels
-        
-        B = self.cfp
-        
-        
-        self.hamiltonian =  \
-            B.B20 * O_20(i.J) + \
-            B.B22 * O_22(i.J) + \
-            B.B40 * O_40(i.J) + \
-            B.B42 * O_42(i.J) + \
-            B.B44 * O_44(i.J) + \
-            B.B60 * O_60(i.J) + \
-            B.B62 * O_62(i.J) + \
-            B.B64 * O_64(i.J) + \
-            B.B66 * O_66(i.J) + \
-            C.uB * i.gJ * (self.Jx * self.H[0] + self.Jy * self.H[1] + self.Jz * self.H[2])
+        cache = _diskcache.active()
+        if cache is not None and not self.eigvals_only:
+            t = _timing.start()
+            # only part of the states is stored for the sparse solver
+            extra = (self.k,) if self._sparse() else ()
+            key = cache.key(self.name, self.H, self._pars, self.rtol, self.atol, *extra)
+            data = cache.get(key)
+            _timing.stop("re._calculate.cache", t)
+            if data is not None:
+                self.__dict__.update(data)
+                return
         
-        E, U = eig(self.hamiltonian);
+        t = _timing.start()
+        sparse = self._sparse()
+        H, blocks = self.hamiltonian, self._blocks()
+        if not sparse and not isinstance(H, np.ndarray):
+            H = H.toarray()       # all states of the sparse solver
+        _timing.stop("re._calculate.assembly", t)
         
-        self.rawenergy = np.real(E);  
-        if sum(np.iscomplex(E)) > 0:
-            raise ValueError('Final energies are complex!')
+        t = _timing.start()
+        if sparse:
+            E, U = _sparseeigh(H, self.k, self.eigvals_only)
+        elif blocks is None:
+            # hamiltonian is hermitian, eigenvalues are real and sorted
+            E, U = (eigvalsh(H), None) if self.eigvals_only else eigh(H)
+        else:
+            E, U = _blockeigh(H, blocks, self.eigvals_only)
+        _timing.stop("re._calculate.eig", t)
+        if self.eigvals_only:
+            self.rawenergy = E
+            return
         
-        self.Jz = dot(dot(U.conj().transpose(), self.Jz), U)   # conversion of matrices to the basis of eigenvectors
-        self.Jx = dot(dot(U.conj().transpose(), self.Jx), U)   # it is then easier to calculate <i|J|j>
-        self.Jy = dot(dot(U.conj().transpose(), self.Jy), U)
-        
-        self.moment[:,0] = - i.gJ * np.real(diag(self.Jx))     # calculation of projections of moments for every eigenvector   
-        self.moment[:,1] = - i.gJ * np.real(diag(self.Jy))                      
-        self.moment[:,2] = - i.gJ * np.real(diag(self.Jz))
+        #change the sign to be positive :)
+        U = U * np.where(np.real(np.sum(U, axis=0)) < 0, -1, 1)
         
+        self.rawenergy = E
         self.rawev = U
+        if cache is not None:
+            t = _timing.start()
+            cache.put(key, {name: getattr(self, name) for name in re._cachedattrs})
+            _timing.stop("re._calculate.cache", t)
+
+
+
+def _Jdot(ops, field):
+    """Returns projection of the angular momentum operator to field(s)
+
+    Field is a vector or a stack of vectors with shape (..., 3), operators
+    of :func:`crysfipy.cfmatrix.operators` are dense or sparse (only for one
+    vector). Jy is skipped when no field has y component, so hamiltonians
+    are kept real if possible. The Zeeman term is ``C.uB * gJ * _Jdot(ops, H)``.
+    """
+    f = np.asarray(field, float)
+    if f.ndim == 1:
+        ret = ops.Jx * f[0] + ops.Jz * f[2]
+        if f[1] != 0:
+            ret = ret + ops.Jy * f[1]
+        return ret
+    f = f[..., np.newaxis, np.newaxis]
+    ret = f[..., 0, :, :] * ops.Jx + f[..., 2, :, :] * ops.Jz
+    if np.any(f[..., 1, :, :] != 0):
+        ret = ret + f[..., 1, :, :] * ops.Jy
+    return ret
+
+#: Minimal size of the hamiltonian for which the block solver is used automatically by re.
+#: For smaller matrices overhead of splitting is larger than the gain.
+_BLOCK_MIN = 32
+
+def _blocks(pars, field, n):
+    """Returns list of indices of independent blocks of the hamiltonian or None
+
+    Stevens operator :math:`O_k^q` couples only states with M differing by q,
+    so if the field is along z, states with M differing by a multiple of
+    the greatest common divisor of all q with non-zero parameter form
+    independent blocks. Parameters can be stacked, then blocks common
+    to all sets are returned.
+    """
+    field = np.reshape(field, (-1, 3))
+    if np.any(field[:, :2] != 0):
+        return None
+    nonzero = np.any(np.reshape(pars, (-1, len(STEVENS))) != 0, axis = 0)
+    q = 0
+    for name, used in zip(STEVENS, nonzero):
+        if used:
+            q = gcd(q, int(name[2]))
+    if q == 1:
+        return None
+    if q == 0:
+        # hamiltonian is diagonal
+        q = n
+    return [np.arange(r, n, q) for r in range(min(q, n))]
+
+def _blockeigh(H, blocks, eigvals_only = False):
+    """Diagonalizes block-diagonal hermitian matrices
+
+    Blocks are padded to the same size and diagonalized by one batched call.
+    Padded states are decoupled with diagonal value above all eigenvalues
+    (Gershgorin bound), so they are always the last ones and are dropped.
+    Matrices can be stacked along leading axes. Returns sorted eigenvalues
+    and eigenvectors (None for eigvals_only).
+    """
+    m = max(len(b) for b in blocks)
+    idx = np.full((len(blocks), m), -1)
+    for k, b in enumerate(blocks):
+        idx[k, :len(b)] = b
+    valid = idx >= 0
+    safe = np.where(valid, idx, 0)
+    Hb = H[..., safe[:, :, np.newaxis], safe[:, np.newaxis, :]] * (valid[:, :, np.newaxis] & valid[:, np.newaxis, :])
+    pad = np.max(np.sum(np.abs(H), axis = -1), axis = -1) + 1
+    Hb[..., np.arange(m), np.arange(m)] += np.where(valid, 0, np.reshape(pad, np.shape(pad) + (1, 1)))
+    if eigvals_only:
+        return np.sort(eigvalsh(Hb)[..., valid], axis = -1), None
+    E, V = eigh(Hb)
+    # valid eigenvalues are the first len(block) of every block, like valid states
+    E = E[..., valid]
+    cols = (np.cumsum(valid.ravel()) - 1).reshape(valid.shape)
+    b, i, j = np.nonzero(valid[:, :, np.newaxis] & valid[:, np.newaxis, :])
+    U = np.zeros(H.shape, V.dtype)
+    U[..., safe[b, i], cols[b, j]] = V[..., b, i, j]
+    order = np.argsort(E, axis = -1, kind = "stable")
+    return np.take_along_axis(E, order, axis = -1), np.take_along_axis(U, order[..., np.newaxis, :], axis = -1)
+
+def _sparseeigh(H, k, eigvals_only = False):
+    """Lowest k eigenvalues (and eigenvectors) of sparse hermitian matrix, sorted"""
+    from scipy.sparse.linalg import eigsh
+    if eigvals_only:
+        return np.sort(eigsh(H, k, which = "SA", return_eigenvectors = False)), None
+    E, U = eigsh(H, k, which = "SA")
+    order = np.argsort(E)
+    return E[order], U[:, order]
+
+def _degeneracy(energy, rtol = 1e-5, atol = 1e-8):
+    """Returns labels of degenerate levels for sorted energies.
+
+    Args:
+        energy (array of floats): energies sorted along the last axis
+        rtol, atol (float): tolerances of the degeneracy, see :func:`numpy.isclose`
+
+    Level starts wherever the energy differs from the previous one, labels are
+    obtained by cumulative sum of the starts. Returns labels and mask of the
+    first state of every level.
+    """
+    start = np.ones(energy.shape, bool)
+    start[..., 1:] = np.abs(np.diff(energy, axis = -1)) > atol + rtol * np.abs(energy[..., 1:])
+    return np.cumsum(start, axis = -1) - 1, start
+
+def _degsum(labels, X):
+    """Sums the matrix X over blocks of degenerate levels.
+
+    Returns matrix of the same shape as X, where only the first *levels x levels*
+    block is filled and the rest is padded with zeros.
+    """
+    P = (labels[..., :, np.newaxis] == np.arange(labels.shape[-1])).astype(float)
+    return np.swapaxes(P, -1, -2) @ X @ P
+
+
+class rebatch:
+    """Energy levels of one ion for many sets of CF parameters
+
+    All sets are diagonalized at once and results are stored in stacked arrays,
+    the first axis corresponds to the parameter set. Matrices of degenerate
+    levels are padded with zeros up to the size (2J+1, 2J+1), the number of
+    valid levels is stored in `nlevels`.
+
+    Attributes:
+        name (str): Name of the ion.
+        field (array of floats): external magnetic field applied in *T*, either
+            common one or (N, 3) array with field for every parameter set.
+        pars (2D array of floats): Stevens parameters with shape (N, 9) in the order
+            given by :data:`crysfipy.cfmatrix.STEVENS`.
+        rtol, atol (float, optional): Tolerances of the degeneracy of the levels.
+        solver (str, optional): "auto" (default) uses block diagonalization when all
+            parameter sets split the hamiltonian into blocks, "dense" forces the full one.
+
+    Examples:
+
+        >>> b = rebatch("Ce", [0,0,0], [[0,0,10,0,50,0,0,0,0], [0,0,1,0,5,0,0,0,0]])
+        >>> b.deg_e[:, :2, 0]
+        array([[   0., 3600.],
+               [   0.,  360.]])
+    """
+
+    def __init__(self, name, field, pars, rtol = 1e-5, atol = 1e-8, solver = "auto"):
+        self.name = name
+        self.rtol = rtol
+        self.atol = atol
+        self.field = field
+        self.pars = np.atleast_2d(np.asarray(pars, float))
+        if self.pars.shape[-1] != len(STEVENS):
+            raise ValueError("Parameters have to be given as (N, %d) array" % len(STEVENS))
+
+        i = ion(name)
+        self.J = i.J
+        self.gJ = i.gJ
+        self.H = np.array(field, float)
+        self.H_size = np.sqrt(np.sum(np.square(self.H), axis = -1))
+        # direction is zero in zero field
+        self.H_direction = self.H / np.where(self.H_size > 0, self.H_size, np.inf)[..., np.newaxis]
+        ops = operators(i.J)
+        self._ops = ops
+
+        self.hamiltonian = np.tensordot(self.pars, ops.O, axes = 1) + \
+            C.uB * i.gJ * _Jdot(ops, self.H)
+        blocks = None if solver == "dense" else _blocks(self.pars, self.H, len(ops.Jz))
+        if blocks is None:
+            self.rawenergy, U = np.linalg.eigh(self.hamiltonian)
+        else:
+            self.rawenergy, U = _blockeigh(self.hamiltonian, blocks)
+
+        #change the sign to be positive :)
+        U = U * np.where(np.real(np.sum(U, axis = -2, keepdims = True)) < 0, -1, 1)
+        self.ev = U
+        self.energy = self.rawenergy - self.rawenergy[:, :1]    # shift to zero level
+
+        Uh = np.conj(np.swapaxes(U, -1, -2))
+        self.Jx = Uh @ ops.Jx @ U
+        self.Jy = Uh @ ops.Jy @ U
+        self.Jz = Uh @ ops.Jz @ U
+        self.moment = - i.gJ * np.real(np.stack([
+            np.diagonal(self.Jx, axis1 = -2, axis2 = -1),
+            np.diagonal(self.Jy, axis1 = -2, axis2 = -1),
+            np.diagonal(self.Jz, axis1 = -2, axis2 = -1)], axis = -1))
+
+        self.Jx2 = np.square(np.abs(self.Jx))
+        self.Jy2 = np.square(np.abs(self.Jy))
+        self.Jz2 = np.square(np.abs(self.Jz))
 
+        labels, start = _degeneracy(self.energy, rtol, atol)
+        self._labels = labels
+        self.nlevels = labels[:, -1] + 1
+        self.deg_e = np.zeros(self.energy.shape + (2,))
+        self.deg_e[np.nonzero(start)[0], labels[start], 0] = self.energy[start]
+        np.add.at(self.deg_e[..., 1], (np.arange(len(labels))[:, np.newaxis], labels), 1)
+        self.deg_Jx2 = _degsum(labels, self.Jx2)
+        self.deg_Jy2 = _degsum(labels, self.Jy2)
+        self.deg_Jz2 = _degsum(labels, self.Jz2)
+        self.deg_Jt2 = 2.0 / 3 * (self.deg_Jx2 + self.deg_Jy2 + self.deg_Jz2)
+
+    def __len__(self):
+        return len(self.pars)
+
+    @_cached_property
+    def _O(self):
+        """Stevens operators in the basis of eigenvectors, shape (N, 9, 2J+1, 2J+1)"""
+        U = self.ev[:, np.newaxis]
+        return np.conj(np.swapaxes(U, -1, -2)) @ self._ops.O @ U
+
+    def energy_jacobian(self):
+        """Returns derivatives of energies with respect to Stevens parameters
 
+        See :meth:`re.energy_jacobian`, returns array with shape (N, 2J+1, 9).
+        Derivatives of :func:`susceptibility` and :func:`neutronint` are given
+        by :func:`susceptibility_jacobian` and :func:`neutronint_jacobian`.
+        """
+        U = self.ev
+        d = np.real(np.einsum("bin,kij,bjn->bnk", U.conj(), self._ops.O, U))
+        labels = self._labels
+        P = (labels[..., :, np.newaxis] == np.arange(labels.shape[-1])).astype(float)
+        # mean over degenerate levels
+        d = P @ ((np.swapaxes(P, -1, -2) @ d) / np.maximum(np.sum(P, axis = -2), 1)[..., np.newaxis])
+        return d - d[:, :1]
 
+
+@_timing.timed("neutronint.thermal")
 def _rawneutronint(E, deg, J2, gJ, T):
     """Returns transition intensities in barn.
 
@@ -298,17 +730,46 @@ def _rawneutronint(E, deg, J2, gJ, T):
         deg (1D array of floats): degeneracies of the levels
         J2 (2D array of floats): matrix of squared J
         gJ (float): Landé factor
-        T (float): temperature in *K*
+        T (float or array of floats): temperature in *K*
+
+    For array of temperatures, intensities are stacked along the first axis.
     """
     r02 = C.R0 * C.R0  *1e28 # to have value in barn
     c = np.pi * r02 * gJ * gJ
     
-    prst = np.exp(-E*C.eV2K/T)
-    Z = sum(prst*deg) #multiply with degeneracy of the level
+    T = np.asarray(T, float)
+    prst = np.exp(-(E - np.min(E))*C.eV2K/T[..., np.newaxis])
+    Z = np.sum(prst*deg, axis = -1, keepdims = True) #multiply with degeneracy of the level
     prst = prst / Z
-    trans_int = J2 * prst[:, np.newaxis] * c  #transition intensities in barn
+    trans_int = J2 * prst[..., :, np.newaxis] * c  #transition intensities in barn
     return trans_int
 
+def _J2(ion, direction):
+    """Returns matrix of squared J of degenerate levels for given direction"""
+    if direction == "x":
+        return ion.deg_Jx2
+    elif direction == "y":
+        return ion.deg_Jy2
+    elif direction == "z":
+        return ion.deg_Jz2
+    else:
+        return ion.deg_Jt2
+
+def _jumps(ion):
+    """Returns sorted transition energies and the sorting indices
+
+    For :obj:`rebatch` transitions of every parameter set are sorted along
+    the last axis, those from or to padded levels are infinite and last.
+    """
+    E = ion.deg_e[..., 0]
+    valid = ion.deg_e[..., 1] > 0
+    jumps = np.where(valid[..., np.newaxis, :] & valid[..., :, np.newaxis],
+                     E[..., np.newaxis, :] - E[..., :, np.newaxis], np.inf)
+    jumps = jumps.reshape(E.shape[:-1] + (-1,))
+    order = jumps.argsort(axis = -1, kind = "stable")
+    return np.take_along_axis(jumps, order, -1), order
+
+@_timing.timed("neutronint")
 def neutronint(ion, T, direction = "t"):
     """Returns matrix of energy and transition intensity at given temperature
     
@@ -323,36 +784,303 @@ def neutronint(ion, T, direction = "t"):
             | z - using :math:`J_z`
         
     """
-    jumps = ion.deg_e[:,0] - ion.deg_e[:,0][:, np.newaxis]
-    jumps = jumps.flatten()
-    if direction == "x":
-        J2 = ion.deg_Jx2
-    elif direction == "y":
-        J2 = ion.deg_Jy2
-    elif direction == "z":
-        J2 = ion.deg_Jz2
-    else:
-        J2 = ion.deg_Jt2
-    tint = _rawneutronint(ion.deg_e[:,0], ion.deg_e[:,1], J2, ion.gJ, T).flatten()
-    tint = tint[jumps.argsort()]
-    return np.array([np.sort(jumps),tint]) 
+    jumps, order = _jumps(ion)
+    tint = _rawneutronint(ion.deg_e[:,0], ion.deg_e[:,1], _J2(ion, direction), ion.gJ, T).flatten()
+    return np.array([jumps, tint[order]])
+
+@_timing.timed("neutronint_grid")
+def neutronint_grid(ion, T, directions = "xyzt"):
+    """Returns transition energies and intensities for grid of temperatures and directions
+
+    Args:
+        ion (:obj:`crysfipy.reion.re`): Rare-earth ion object
+        T (1D array of floats): temperatures in *K*
+        directions (str or list of str): Directions of the Q, see :func:`neutronint`
+
+    Returns:
+        tuple of sorted transition energies with shape (nTransitions,) and
+        intensities with shape (nT, nDir, nTransitions).
+
+    Examples:
 
+        >>> E, I = neutronint_grid(ion, [2, 10, 300], "xz")
+        >>> I.shape
+        (3, 2, 289)
+    """
+    jumps, order = _jumps(ion)
+    J2 = np.array([_J2(ion, d) for d in directions])
+    T = np.atleast_1d(np.asarray(T, float))
+    tint = _rawneutronint(ion.deg_e[:,0], ion.deg_e[:,1], J2, ion.gJ, T[:, np.newaxis])
+    tint = tint.reshape(tint.shape[:2] + (-1,))
+    return jumps, tint[..., order]
+
+@_timing.timed("susceptibility.thermal")
 def _rawsusceptibility(energy, moment, H_direction, H_size, T):
-    """Returns susceptibility calculated for energy levels at given temperature"""
+    """Returns susceptibility calculated for energy levels at given temperature
+
+    Args:
+        energy (1D array of floats): energy levels
+        moment (2D array of floats): projections of moments of the levels
+        H_direction (1D array of floats): unit vector of the field direction
+        H_size (float): size of the field in *T*
+        T (float or array of floats): temperature(s) in *K*
+
+    Energies are shifted to the lowest level before the Boltzmann factors are
+    evaluated, so that large gaps at low temperatures neither overflow nor
+    give zero partition function.
+    """
+
+    T = np.asarray(T, float)
+    E = np.asarray(energy) - np.min(energy)
+    prst = np.exp(-E / T[..., np.newaxis])
+    prst /= np.sum(prst, axis = -1, keepdims = True)  # canonical partition function
+    overal_moment = dot(prst, moment)
+    return dot(overal_moment, np.conj(H_direction)) / H_size
 
-    prst = np.exp(-energy/T)
-    Z = sum(prst);                                    # canonical partition function 
-    prst = prst / Z;
-    overal_moment = dot(prst, moment);
-    return dot(overal_moment, H_direction.conj().transpose()) / H_size
+def rawsusceptibility(energy, moment, H_direction, H_size, T):
+    """Returns susceptibility of precalculated energy levels and moments
 
+    It is :func:`susceptibility` for levels which are not held by
+    :obj:`re`, e.g. columns of a spreadsheet filled from :attr:`re.rawenergy`
+    and :attr:`re.moment`.
+
+    Args:
+        energy (1D array of floats): energy levels in *K*
+        moment (2D array of floats): projections of moments of the levels, shape (n, 3)
+        H_direction (1D array of floats): unit vector of the field direction
+        H_size (float): size of the field in *T*
+        T (float or array of floats): temperature(s) in *K*
+
+    Returns:
+        Array of the same shape as T.
+    """
+    return _rawsusceptibility(np.asarray(energy, float), np.asarray(moment, float),
+                              np.asarray(H_direction, float), H_size, T)
+
+@_timing.timed("susceptibility")
 def susceptibility(ion, T):
-    """Returns susceptibility calculated for given ion at given temperature"""
-
-    y = []
-    try:
-        for temp in T:
-            y.append(_rawsusceptibility(ion.energy, ion.moment, ion.H_direction, ion.H_size, temp))
-    except TypeError as te:
-        y = _rawsusceptibility(ion.energy, ion.moment, ion.H_direction, ion.H_size, T)
-    return y
\ No newline at end of file
+    """Returns susceptibility calculated for given ion at given temperature(s)
+
+    Args:
+        ion (:obj:`crysfipy.reion.re`): Rare-earth ion object
+        T (float or array of floats): temperature(s) in *K*
+
+    All temperatures are evaluated at once, array of the same shape as T
+    is returned.
+    """
+
+    return _rawsusceptibility(ion.energy, ion.moment, ion.H_direction, ion.H_size, T)
+
+@_timing.timed("magnetization")
+def magnetization(ion, H, T, directions = None, weights = None, chunksize = 4096):
+    """Returns magnetization curves M(H, T) along given field directions
+
+    The field independent CF part of the hamiltonian of the ion is reused
+    and hamiltonians for all field points are diagonalized in batches.
+
+    Args:
+        ion (:obj:`crysfipy.reion.re`): Rare-earth ion object, its field is ignored
+        H (1D array of floats): sizes of the field in *T*
+        T (1D array of floats): temperatures in *K*
+        directions (2D array of floats, optional): directions of the field with
+            shape (nDir, 3), default is direction of the field of the ion or z
+        weights (1D array of floats, optional): weights of the directions, if
+            given, weighted average over directions (e.g. powder) is returned
+        chunksize (int): maximal number of hamiltonians diagonalized at once
+
+    Returns:
+        Magnetization along the field in *uB* per ion with shape (nH, nT, nDir),
+        or (nH, nT) if weights are given.
+
+    Examples:
+
+        >>> M = magnetization(ho, np.linspace(0, 10, 101), [2, 10], [[1,0,0], [0,0,1]])
+        >>> M.shape
+        (101, 2, 2)
+    """
+    H = np.atleast_1d(np.asarray(H, float))
+    T = np.atleast_1d(np.asarray(T, float))
+    if directions is None:
+        directions = [ion.H_direction if ion.H_size > 0 else [0, 0, 1]]
+    d = np.atleast_2d(np.asarray(directions, float))
+    d = d / np.sqrt(np.sum(d * d, axis = 1))[:, np.newaxis]
+    ops = operators(ion.J)
+    Hcf = ion._Hcf if isinstance(ion._Hcf, np.ndarray) else ion._Hcf.toarray()
+    Jh = _Jdot(ops, d)                                            # J projected to directions
+
+    # all combinations of directions and fields, direction is the slow index
+    field = (d[:, np.newaxis, :] * H[:, np.newaxis]).reshape(-1, 3)
+    k = np.repeat(np.arange(len(d)), len(H))
+    M = np.empty((len(field), len(T)))
+    for s in range(0, len(field), chunksize):
+        f = field[s:s + chunksize]
+        Hm = Hcf + C.uB * ion.gJ * _Jdot(ops, f)
+        blocks = _blocks(ion._pars, f, len(Hm[0]))
+        E, U = eigh(Hm) if blocks is None else _blockeigh(Hm, blocks)
+        m = - ion.gJ * np.real(np.einsum("bin,bij,bjn->bn", U.conj(), Jh[k[s:s + chunksize]], U))
+        p = np.exp(-(E - E[:, :1])[:, np.newaxis, :] / T[:, np.newaxis])
+        M[s:s + chunksize] = np.sum(p * m[:, np.newaxis, :], axis = -1) / np.sum(p, axis = -1)
+    M = M.reshape(len(d), len(H), len(T)).transpose(1, 2, 0)
+    if weights is not None:
+        w = np.asarray(weights, float)
+        return np.dot(M, w / np.sum(w))
+    return M
+
+def _thermal_kernel(E, labels, T):
+    """Returns Boltzmann populations and kernel of thermal linear response
+
+    Kernel is :math:`K_{nm} = (p_n - p_m)/(E_n - E_m)` with limit 
+    :math:`-p_n/T` inside degenerate levels (same `labels`). Energies and
+    labels may be stacked with shape (..., n), both results are stacked over
+    these axes and then over temperatures T.
+    """
+    T = np.asarray(T, float)
+    shape = E.shape[:-1] + (1,) * T.ndim + E.shape[-1:]
+    E = E.reshape(shape)
+    labels = labels.reshape(shape)
+    T = T[..., np.newaxis]
+    p = np.exp(-(E - np.min(E, axis = -1, keepdims = True)) / T)
+    p /= np.sum(p, axis = -1, keepdims = True)
+    same = labels[..., :, np.newaxis] == labels[..., np.newaxis, :]
+    dE = np.where(same, 1, E[..., :, np.newaxis] - E[..., np.newaxis, :])
+    dp = p[..., :, np.newaxis] - p[..., np.newaxis, :]
+    K = np.where(same, -p[..., :, np.newaxis] / T[..., np.newaxis], dp / dE)
+    return p, K
+
+@_timing.timed("susceptibility_tensor")
+def susceptibility_tensor(ion, T):
+    """Returns susceptibility tensor including Curie and Van Vleck terms
+
+    The tensor :math:`\\chi_{\\alpha\\beta} = dM_\\alpha/dH_\\beta` is
+    calculated by linear response from the eigenbasis matrices of J of the
+    ion, no diagonalization in finite field is needed:
+
+    .. math:: \\chi_{\\alpha\\beta} = g_J^2 \\mu_B \\left[\\sum_{nm}
+        J^\\alpha_{mn} J^\\beta_{nm} \\frac{p_m - p_n}{E_n - E_m}
+        - \\frac{\\langle J^\\alpha \\rangle \\langle J^\\beta \\rangle}{T}\\right]
+
+    where the fraction is :math:`p_n/T` within degenerate levels (Curie term).
+    For ion in zero field it is the initial susceptibility, otherwise the
+    differential susceptibility at the field of the ion.
+
+    Args:
+        ion (:obj:`crysfipy.reion.re`): Rare-earth ion object
+        T (float or array of floats): temperature(s) in *K*
+
+    Returns:
+        Array with shape T.shape + (3, 3) in *uB/T* per ion.
+
+    Examples:
+
+        >>> chi = susceptibility_tensor(re("Ho", [0,0,0], pars), T)
+        >>> chi_powder = np.trace(chi, axis1 = -2, axis2 = -1) / 3
+        >>> chi_111 = np.einsum("a,...ab,b->...", d, chi, d)   # d = [1,1,1]/sqrt(3)
+    """
+    J = np.array([ion.Jx, ion.Jy, ion.Jz])
+    p, K = _thermal_kernel(ion.energy, ion._labels, T)
+    T = np.asarray(T, float)[..., np.newaxis, np.newaxis]
+    mean = np.real(np.einsum("...n,ann->...a", p, J))
+    chi = - np.real(np.einsum("amn,bnm,...nm->...ab", J, J, K)) - \
+        mean[..., :, np.newaxis] * mean[..., np.newaxis, :] / T
+    return C.uB * ion.gJ**2 * chi
+
+def susceptibility_jacobian(ion, T):
+    """Returns derivatives of :func:`susceptibility` with respect to Stevens parameters
+
+    Derivatives are calculated analytically from eigenvectors of the ion
+    (thermal linear response), no additional diagonalization is needed.
+
+    Args:
+        ion (:obj:`crysfipy.reion.re` or :obj:`crysfipy.reion.rebatch`): Rare-earth
+            ion object, the field must not be zero
+        T (float or array of floats): temperature(s) in *K*
+
+    Returns:
+        Array with shape T.shape + (9,), columns follow :data:`crysfipy.cfmatrix.STEVENS`.
+        For :obj:`rebatch` the shape is (N,) + T.shape + (9,).
+    """
+    h = ion.H_direction[..., np.newaxis, np.newaxis]
+    A = - ion.gJ * (ion.Jx * h[..., 0, :, :] + ion.Jy * h[..., 1, :, :] +
+                    ion.Jz * h[..., 2, :, :])       # moment along the field
+    O = ion._O
+    p, K = _thermal_kernel(ion.energy, ion._labels, T)
+    T = np.asarray(T, float)
+    t = (1,) * T.ndim       # temperature axes follow the axes of parameter sets
+    A = A.reshape(A.shape[:-2] + t + A.shape[-2:])
+    O = O.reshape(O.shape[:-3] + t + O.shape[-3:])
+    T = T[..., np.newaxis]
+    meanA = np.real(np.sum(p * np.diagonal(A, axis1 = -2, axis2 = -1), axis = -1))[..., np.newaxis]
+    meanO = np.real(np.einsum("...n,...knn->...k", p, O))
+    dA = np.real(np.einsum("...mn,...knm,...nm->...k", A, O, K)) + meanA * meanO / T
+    return dA / np.reshape(ion.H_size, np.shape(ion.H_size) + t + (1,))
+
+def _dJ2(A, G, L):
+    """Derivatives of matrix of squared J of degenerate levels
+
+    Args:
+        A (2D array): J component in the basis of eigenvectors
+        G (3D array): :math:`O_{k,xy}/(E_y - E_x)` (zero within degenerate levels)
+        L (2D array): indicator matrix of degenerate levels (states x levels)
+
+    All arrays may be stacked along the first axes.
+    """
+    W = np.einsum("...yb,...bJ,...bx->...Jyx", A, L, A, optimize = True)
+    # contracted in two steps, the one-step einsum takes ~10x longer
+    Gy = np.einsum("...kxy,...Jyx->...kJy", G, W)
+    Gx = np.einsum("...kxy,...Jyx->...kJx", G, W)
+    T = np.swapaxes((Gy - Gx) @ L[..., np.newaxis, :, :], -1, -2)
+    return np.real(T + np.swapaxes(T, -1, -2))
+
+def neutronint_jacobian(ion, T, direction = "t"):
+    """Returns derivatives of :func:`neutronint` with respect to Stevens parameters
+
+    Args:
+        ion (:obj:`crysfipy.reion.re` or :obj:`crysfipy.reion.rebatch`): Rare-earth ion object
+        T (float): temperature in *K*
+        direction (str): Direction of the Q, see :func:`neutronint`
+
+    Returns:
+        Array with shape (2, nTransitions, 9), derivatives of transition energies
+        and intensities in the order returned by :func:`neutronint`. Energies of
+        degenerate levels are represented by their mean.
+
+        For :obj:`rebatch` the shape is (N, 2, (2J+1)**2, 9). Transitions of
+        every parameter set are sorted by energy, the first ``nlevels**2`` follow
+        the order of :func:`neutronint` for the set and the rest are zeros.
+    """
+    E = ion.energy
+    labels = ion._labels
+    levels = ion.deg_e.shape[-2]
+    L = (labels[..., :, np.newaxis] == np.arange(levels)).astype(float)
+    deg = ion.deg_e[..., 1]
+    O = ion._O
+    dlev = np.real(np.einsum("...knn,...nI->...kI", O, L)) / \
+        np.maximum(deg, 1)[..., np.newaxis, :]              # derivatives of level energies
+
+    same = labels[..., :, np.newaxis] == labels[..., np.newaxis, :]
+    dE = np.where(same, 1, E[..., np.newaxis, :] - E[..., :, np.newaxis])[..., np.newaxis, :, :]
+    G = np.where(same[..., np.newaxis, :, :], 0, O / dE)
+    if direction in ("x", "y", "z"):
+        dJ2 = _dJ2(getattr(ion, "J" + direction), G, L)
+    else:
+        dJ2 = 2.0 / 3 * (_dJ2(ion.Jx, G, L) + _dJ2(ion.Jy, G, L) + _dJ2(ion.Jz, G, L))
+    J2 = _J2(ion, direction)
+
+    c = np.pi * C.R0 * C.R0 * 1e28 * ion.gJ * ion.gJ
+    beta = C.eV2K / T
+    E = ion.deg_e[..., 0]
+    prst = np.exp(-(E - np.min(E, axis = -1, keepdims = True)) * beta)
+    prst /= np.sum(prst * deg, axis = -1, keepdims = True)
+    prst = prst[..., np.newaxis, :]
+    dprst = prst * beta * (np.sum(prst * deg[..., np.newaxis, :] * dlev, axis = -1, keepdims = True) - dlev)
+    dint = c * (dJ2 * prst[..., np.newaxis] + J2[..., np.newaxis, :, :] * dprst[..., np.newaxis])
+    djumps = dlev[..., np.newaxis, :] - dlev[..., :, np.newaxis]
+
+    jumps, order = _jumps(ion)
+    shape = dint.shape[:-2] + (-1,)
+    order = order[..., np.newaxis, :]
+    djumps = np.take_along_axis(djumps.reshape(shape), order, -1)
+    dint = np.take_along_axis(dint.reshape(shape), order, -1)
+    # transitions of padded levels of rebatch
+    djumps = np.where(np.isfinite(jumps)[..., np.newaxis, :], djumps, 0)
+    return np.swapaxes(np.stack([djumps, dint], axis = -3), -1, -2)
@@ -0,0 +1,289 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Scans of CF levels over grids of Stevens parameters and fields"""
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sys
+import numpy as np
+
+from crysfipy.const import ion
+from crysfipy.cfmatrix import STEVENS, operators
+from crysfipy.reion import cfpars, rebatch
+
+
+def parameters(sym, values):
+    """Returns (N, 9) array of Stevens parameters respecting symmetry constrains
+
+    Args:
+        sym (str): Symmetry, see :obj:`crysfipy.reion.cfpars`
+        values (dict): Stevens parameter name -> array of N values
+    """
+    sym = sym[0] if sym[0] in cfpars.pars else "o"
+    allowed = cfpars.pars[sym][1]
+    if sym == "c":
+        allowed = ["B40", "B60"]
+    n = len(np.atleast_1d(next(iter(values.values())))) if values else 1
+    P = np.zeros((n, len(STEVENS)))
+    for name, value in values.items():
+        if name not in allowed:
+            raise ValueError("Parameter %s is not allowed for %s symmetry" % (name, cfpars.pars[sym][0]))
+        P[:, STEVENS.index(name)] = value
+    if sym == "c":
+        P[:, STEVENS.index("B44")] = 5 * P[:, STEVENS.index("B40")]
+        P[:, STEVENS.index("B64")] = -21 * P[:, STEVENS.index("B60")]
+    return P
+
+
+class scanresult:
+    """Results of :func:`scan`
+
+    Attributes:
+        axes (dict): Scanned axes, name -> values, in the order of the grid dimensions.
+        shape (tuple): Shape of the grid.
+        pars (array of floats): Stevens parameters of every point, shape (N, 9).
+        field (array of floats): Field of every point, shape (N, 3).
+
+    Every collected observable of :obj:`crysfipy.reion.rebatch` is stored as
+    attribute with shape ``shape + item shape``, e.g. ``energy`` has shape
+    ``shape + (2J+1,)``.
+    """
+
+    def __init__(self, axes, pars, field, data):
+        self.axes = axes
+        self.shape = tuple(len(v) for v in axes.values())
+        self.pars = pars
+        self.field = field
+        self.observables = tuple(data)
+        for name, value in data.items():
+            setattr(self, name, value.reshape(self.shape + value.shape[1:]))
+
+
+def _warmup(J):
+    """Initializes worker process with precomputed operators"""
+    operators(J)
+
+def _chunk(name, pars, field, observables, rtol, atol):
+    """Diagonalizes one chunk of the scan, runs in the worker process"""
+    b = rebatch(name, field, pars, rtol = rtol, atol = atol)
+    return {obs: np.ascontiguousarray(getattr(b, obs)) for obs in observables}
+
+def _grid(axes, field, sym):
+    """Returns parameters and fields for all points of the grid in C order"""
+    names = list(axes)
+    values = [np.asarray(axes[name], float) for name in names]
+    grids = np.meshgrid(*[np.arange(len(v)) for v in values], indexing = "ij")
+    idx = {name: g.ravel() for name, g in zip(names, grids)}
+    n = grids[0].size if grids else 1
+    pars = parameters(sym, {name: values[k][idx[name]] for k, name in enumerate(names)
+                            if name != "field"})
+    pars = np.broadcast_to(pars, (n, len(STEVENS))).copy()
+    if "field" in axes:
+        field = values[names.index("field")][idx["field"]]
+    else:
+        field = np.broadcast_to(np.asarray(field, float), (n, 3)).copy()
+    return pars, field
+
+def _run(name, pars, field, observables, workers, chunksize, rtol, atol, starts = None):
+    """Yields (start, results) for consecutive chunks in order
+
+    Only chunks beginning at `starts` are calculated, default are all.
+    """
+    if starts is None:
+        starts = range(0, len(pars), chunksize)
+    starts = list(starts)
+    if not starts:
+        return
+    args = [(name, pars[s:s + chunksize], field[s:s + chunksize], observables, rtol, atol)
+            for s in starts]
+    if workers is not None and workers <= 1:
+        for s, a in zip(starts, args):
+            yield s, _chunk(*a)
+        return
+    # initializer of the pool needs Python 3.7, otherwise operators are
+    # built by the first chunk in every worker
+    warmup = {"initializer": _warmup, "initargs": (ion(name).J,)} \
+        if sys.version_info >= (3, 7) else {}
+    with ProcessPoolExecutor(max_workers = workers, **warmup) as pool:
+        # map keeps the order of the chunks, so results are deterministic
+        for s, res in zip(starts, pool.map(_chunk, *zip(*args))):
+            yield s, res
+
+# Observables of rebatch stored by scanstore: name -> (dtype, item shape),
+# "n" is the number of states 2J+1
+_SCHEMA = {
+    "rawenergy": ("f8", ("n",)),
+    "energy": ("f8", ("n",)),
+    "ev": ("c16", ("n", "n")),
+    "Jx": ("c16", ("n", "n")),
+    "Jy": ("c16", ("n", "n")),
+    "Jz": ("c16", ("n", "n")),
+    "Jx2": ("f8", ("n", "n")),
+    "Jy2": ("f8", ("n", "n")),
+    "Jz2": ("f8", ("n", "n")),
+    "moment": ("f8", ("n", 3)),
+    "nlevels": ("i8", ()),
+    "deg_e": ("f8", ("n", 2)),
+    "deg_Jx2": ("f8", ("n", "n")),
+    "deg_Jy2": ("f8", ("n", "n")),
+    "deg_Jz2": ("f8", ("n", "n")),
+    "deg_Jt2": ("f8", ("n", "n")),
+}
+
+class scanstore:
+    """Directory of memory-mapped ``.npy`` files with results of :func:`scan`
+
+    Every observable is preallocated as ``<observable>.npy`` with shape
+    (N,) + item shape fixed by the ion, so chunks are written in place as
+    they are calculated. ``done.npy`` marks finished chunks and
+    ``schema.json`` describes the scan, an interrupted scan is resumed by
+    calling :func:`scan` with the same arguments and `out`.
+
+    Attributes:
+        path (str): Directory of the store.
+        schema (dict): Ion, axes, field, observables and chunking of the scan.
+        done (1D array of bools): Finished chunks.
+    """
+
+    def __init__(self, path, schema = None):
+        self.path = path
+        fname = os.path.join(path, "schema.json")
+        if schema is None:
+            with open(fname) as f:
+                self.schema = json.load(f)
+            return
+        if os.path.exists(fname):
+            with open(fname) as f:
+                stored = json.load(f)
+            if stored != schema:
+                raise ValueError("Store %s contains results of a different scan" % path)
+            self.schema = stored
+            return
+        for obs in schema["observables"]:
+            if obs not in _SCHEMA:
+                raise ValueError("Observable %s can not be stored, use one of %s" % (obs, list(_SCHEMA)))
+        os.makedirs(path, exist_ok = True)
+        n = ion(schema["name"]).J2p1
+        N = schema["npoints"]
+        for obs in schema["observables"]:
+            dtype, shape = _SCHEMA[obs]
+            shape = (N,) + tuple(n if d == "n" else d for d in shape)
+            np.lib.format.open_memmap(self._file(obs), "w+", dtype, shape).flush()
+        nchunks = -(-N // schema["chunksize"])
+        np.save(self._file("done"), np.zeros(nchunks, bool))
+        # schema is written last, it marks complete preallocation
+        with open(fname + ".tmp", "w") as f:
+            json.dump(schema, f, indent = 1)
+        os.replace(fname + ".tmp", fname)
+        self.schema = schema
+
+    def _file(self, name):
+        return os.path.join(self.path, name + ".npy")
+
+    @property
+    def done(self):
+        return np.load(self._file("done"))
+
+    def todo(self):
+        """Returns starts of the chunks which are not finished"""
+        return [k * self.schema["chunksize"] for k in np.nonzero(~self.done)[0]]
+
+    def write(self, start, data):
+        """Writes results of the chunk beginning at start and marks it as finished"""
+        for obs, value in data.items():
+            m = np.load(self._file(obs), mmap_mode = "r+")
+            m[start:start + len(value)] = value
+            m.flush()
+            del m
+        done = np.load(self._file("done"), mmap_mode = "r+")
+        done[start // self.schema["chunksize"]] = True
+        done.flush()
+
+    def result(self):
+        """Returns :obj:`scanresult` with read-only memory-mapped arrays"""
+        sc = self.schema
+        axes = {name: np.array(values) for name, values in sc["axes"]}
+        pars, field = _grid(axes, sc["field"], sc["sym"])
+        data = {obs: np.load(self._file(obs), mmap_mode = "r") for obs in sc["observables"]}
+        return scanresult(axes, pars, field, data)
+
+
+def load(path):
+    """Opens results of :func:`scan` stored in directory path
+
+    Arrays are memory-mapped read-only, only the accessed parts are loaded.
+    Unfinished chunks of an interrupted scan contain zeros.
+    """
+    return scanstore(path).result()
+
+def scan(name, axes, sym = "o", field = [0, 0, 0],
+         observables = ("energy", "deg_e", "nlevels", "moment"),
+         workers = None, chunksize = 1024, rtol = 1e-5, atol = 1e-8, out = None):
+    """Calculates CF levels on a grid of Stevens parameters (and fields)
+
+    Grid points are split into chunks which are diagonalized by
+    :obj:`crysfipy.reion.rebatch` in a pool of worker processes.
+
+    Args:
+        name (str): Name of the ion.
+        axes (dict): Scanned axes, Stevens parameter name -> 1D array of values.
+            Special axis ``field`` takes (nF, 3) array of field vectors.
+            Grid dimensions follow the order of the dictionary.
+        sym (str): Symmetry used to check the scanned parameters and to apply
+            constrains, see :obj:`crysfipy.reion.cfpars`.
+        field (1D array of floats): Field in *T* used when it is not scanned.
+        observables (list of str): Attributes of :obj:`crysfipy.reion.rebatch`
+            to collect.
+        workers (int, optional): Number of worker processes, default is number
+            of CPUs. With 0 or 1 the scan runs in the current process.
+        chunksize (int): Number of grid points diagonalized at once.
+        out (str, optional): Directory of :obj:`scanstore` the results are
+            streamed to instead of memory. If it contains an interrupted
+            scan with the same arguments, only unfinished chunks are calculated.
+
+    Returns:
+        :obj:`scanresult`, with `out` its arrays are read-only memory maps.
+
+    Examples:
+
+        >>> r = scan("Pr", {"B20": np.linspace(-1, 1, 21), "B40": np.linspace(-0.01, 0.01, 11)},
+        ...          sym = "t", workers = 4)
+        >>> r.energy.shape
+        (21, 11, 9)
+    """
+    if out is not None:
+        schema = {"name": name, "sym": sym,
+                  "axes": [[k, np.asarray(v, float).tolist()] for k, v in axes.items()],
+                  "field": np.asarray(field, float).tolist(),
+                  "observables": list(observables), "chunksize": chunksize,
+                  "rtol": rtol, "atol": atol}
+    pars, field = _grid(axes, field, sym)
+    if out is not None:
+        schema["npoints"] = len(pars)
+        store = scanstore(out, schema)
+        for s, res in _run(name, pars, field, observables, workers, chunksize, rtol, atol,
+                           store.todo()):
+            store.write(s, res)
+        return store.result()
+    data = {}
+    for s, res in _run(name, pars, field, observables, workers, chunksize, rtol, atol):
+        for obs, value in res.items():
+            if obs not in data:
+                data[obs] = np.empty((len(pars),) + value.shape[1:], value.dtype)
+            elif not np.can_cast(value.dtype, data[obs].dtype):
+                # e.g. eigenvectors become complex in chunks with y field
+                data[obs] = data[obs].astype(np.result_type(data[obs], value))
+            data[obs][s:s + len(value)] = value
+    return scanresult(dict(axes), pars, field, data)
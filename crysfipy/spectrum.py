@@ -0,0 +1,85 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Broadening of stick spectra from :func:`crysfipy.reion.neutronint`"""
+
+import numpy as np
+
+_FWHM2SIGMA = 1.0 / (2 * np.sqrt(2 * np.log(2)))
+
+
+def gaussian(x, center, fwhm):
+    """Gaussian profile with unit area"""
+    sigma = fwhm * _FWHM2SIGMA
+    return np.exp(-0.5 * np.square((x - center) / sigma)) / (sigma * np.sqrt(2 * np.pi))
+
+def lorentzian(x, center, fwhm):
+    """Lorentzian profile with unit area"""
+    hwhm = 0.5 * fwhm
+    return hwhm / np.pi / (np.square(x - center) + hwhm * hwhm)
+
+def pseudovoigt(x, center, fwhm, eta = 0.5):
+    """Pseudo-Voigt profile with unit area, eta is the Lorentzian fraction"""
+    return eta * lorentzian(x, center, fwhm) + (1 - eta) * gaussian(x, center, fwhm)
+
+profiles = {
+    "gaussian": gaussian,
+    "lorentzian": lorentzian,
+    "pseudovoigt": pseudovoigt,
+}
+
+def spectrum(E, energies, intensities, fwhm, profile = "lorentzian", eta = 0.5, cutoff = 0):
+    """Returns broadened spectrum S(E) for given transitions
+
+    Args:
+        E (1D array of floats): energy grid
+        energies (array of floats): transition energies, the last axis is
+            the transition, leading axes are broadcasted against intensities
+        intensities (array of floats): transition intensities, leading axes
+            can be used for batches of parameter sets, temperatures etc.
+        fwhm (float or array of floats): full width at half maximum, either
+            common one or for every transition
+        profile (str): Shape of the lines
+            
+            | lorentzian (default)
+            | gaussian
+            | pseudovoigt - mixture with Lorentzian fraction `eta`
+        cutoff (float): transitions weaker than `cutoff` times the strongest
+            transition in the whole batch are skipped
+
+    Returns:
+        Array of shape (..., len(E)).
+
+    Examples:
+
+        >>> E = np.linspace(-5, 50, 1000)
+        >>> S = spectrum(E, *neutronint(ho, 10), fwhm = 1.5, cutoff = 1e-4)
+    """
+    E = np.asarray(E, float)
+    energies = np.asarray(energies, float)
+    intensities = np.asarray(intensities, float)
+    energies, intensities, fwhm = np.broadcast_arrays(energies, intensities, 
+                                                      np.asarray(fwhm, float))
+    if cutoff > 0:
+        strong = np.abs(intensities) >= cutoff * np.max(np.abs(intensities))
+        keep = np.any(strong.reshape(-1, strong.shape[-1]), axis = 0)
+        energies = energies[..., keep]
+        intensities = np.where(strong, intensities, 0)[..., keep]
+        fwhm = fwhm[..., keep]
+    if profile == "pseudovoigt":
+        shape = pseudovoigt(E[:, np.newaxis], energies[..., np.newaxis, :], 
+                            fwhm[..., np.newaxis, :], eta)
+    else:
+        shape = profiles[profile](E[:, np.newaxis], energies[..., np.newaxis, :], 
+                                  fwhm[..., np.newaxis, :])
+    return np.matmul(shape, intensities[..., np.newaxis])[..., 0]
@@ -0,0 +1,105 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Thermodynamics of the CF levels
+
+All quantities are evaluated in one broadcasted pass over the levels and
+temperatures. Boltzmann factors are referred to the lowest level, so they
+neither overflow nor underflow to zero partition function for large gaps.
+
+Levels are taken from :obj:`crysfipy.reion.re`, :obj:`crysfipy.reion.rebatch`
+or an array of energies (one level per state, degenerate levels repeated)
+with shape (..., n). Energies are in *meV* by default and converted to *K*
+by :data:`crysfipy.const.eV2K`, the same as in :func:`crysfipy.reion.neutronint`.
+Use ``units = "K"`` for energies already in *K*.
+
+Heat capacity and entropy are in units of *kB* per ion, multiply them by
+``const.NA * const.kB_SI`` to get *J/(mol K)*.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+import crysfipy.const as C
+
+_UNITS = {"meV": C.eV2K, "K": 1.0}
+
+thermodata = namedtuple("thermodata", ["Z", "U", "C", "S", "F"])
+thermodata.__doc__ = """Thermodynamic quantities with shape ``levels.shape[:-1] + T.shape``
+
+Attributes:
+    Z: Partition function referred to the lowest level, i.e. with energies
+        measured from the ground state.
+    U: Internal energy in the units of the levels.
+    C: Heat capacity in *kB* per ion.
+    S: Entropy in *kB* per ion.
+    F: Free energy in the units of the levels.
+"""
+
+def _levels(source):
+    """Returns array of energies of the states"""
+    return np.asarray(getattr(source, "energy", source), float)
+
+def thermodynamics(source, T, units = "meV"):
+    """Returns :obj:`thermodata` of the levels at temperatures T
+
+    Args:
+        source: :obj:`crysfipy.reion.re`, :obj:`crysfipy.reion.rebatch` or array
+            of energies with shape (..., n).
+        T (float or array of floats): temperature(s) in *K*, they must be positive.
+        units (str): units of the energies, "meV" or "K".
+
+    Examples:
+
+        >>> ho = re("Ho", [0,0,0], ["t", -0.17, 0.001])
+        >>> th = thermodynamics(ho, np.linspace(1, 300, 300))
+        >>> th.C * C.NA * C.kB_SI   # Schottky heat capacity in J/(mol K)
+    """
+    try:
+        factor = _UNITS[units]
+    except KeyError:
+        raise ValueError("Unknown units %s, use one of %s" % (units, list(_UNITS)))
+    E = _levels(source) * factor
+    T = np.asarray(T, float)
+    # levels (..., n) -> (..., 1, ..., 1, n) to broadcast against T
+    shape = E.shape[:-1] + (1,) * T.ndim
+    E0 = np.min(E, axis = -1).reshape(shape)
+    dE = E.reshape(shape + E.shape[-1:]) - E0[..., np.newaxis]
+    w = np.exp(-dE / T[..., np.newaxis])
+    Z = np.sum(w, axis = -1)          # >= 1, ground state has weight one
+    p = w / Z[..., np.newaxis]
+    e = np.sum(p * dE, axis = -1)     # mean excitation energy
+    var = np.sum(p * np.square(dE - e[..., np.newaxis]), axis = -1)
+    logZ = np.log(Z)
+    return thermodata(Z, (E0 + e) / factor, var / T**2, logZ + e / T,
+                      (E0 - T * logZ) / factor)
+
+def partition_function(source, T, units = "meV"):
+    """Returns partition function referred to the lowest level, see :func:`thermodynamics`"""
+    return thermodynamics(source, T, units).Z
+
+def internal_energy(source, T, units = "meV"):
+    """Returns internal energy in the units of the levels, see :func:`thermodynamics`"""
+    return thermodynamics(source, T, units).U
+
+def heat_capacity(source, T, units = "meV"):
+    """Returns heat capacity in *kB* per ion, see :func:`thermodynamics`"""
+    return thermodynamics(source, T, units).C
+
+def entropy(source, T, units = "meV"):
+    """Returns entropy in *kB* per ion, see :func:`thermodynamics`"""
+    return thermodynamics(source, T, units).S
+
+def free_energy(source, T, units = "meV"):
+    """Returns free energy in the units of the levels, see :func:`thermodynamics`"""
+    return thermodynamics(source, T, units).F
@@ -0,0 +1,115 @@
+# Copyright 2014-2018 Petr Čermák, Jan Zubáč and Karel Pajskr
+# This file is part of CrysFiPy.
+# CrysFiPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CrysFiPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# <http://www.gnu.org/licenses/>.
+
+"""Opt-in timing of the calculation stages
+
+Profiling is off by default and the instrumented code then only checks
+one global variable. It is switched on by :func:`profile` context manager
+or globally by :func:`enable`:
+
+    >>> from crysfipy.reion import profile
+    >>> with profile() as prof:
+    ...     ho = re("Ho", [0,0,1], ["t", -0.17, 0.001])
+    ...     susceptibility(ho, T)
+    >>> print(prof.report())
+
+Times of nested stages are included in the times of the outer ones.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+
+class profiler:
+    """Aggregated wall times and call counts of the stages"""
+
+    def __init__(self):
+        self.data = {}
+
+    def add(self, stage, dt):
+        s = self.data.get(stage)
+        if s is None:
+            self.data[stage] = [1, dt]
+        else:
+            s[0] += 1
+            s[1] += dt
+
+    def reset(self):
+        self.data.clear()
+
+    def stats(self):
+        """Returns dictionary stage -> {"calls", "time", "mean"}, times in seconds"""
+        return {stage: {"calls": n, "time": t, "mean": t / n}
+                for stage, (n, t) in self.data.items()}
+
+    def report(self):
+        """Returns table of the stages sorted by total time"""
+        ret = "%-32s %8s %12s %12s\n" % ("stage", "calls", "total [ms]", "mean [us]")
+        for stage, (n, t) in sorted(self.data.items(), key = lambda x: -x[1][1]):
+            ret += "%-32s %8d %12.3f %12.3f\n" % (stage, n, t * 1e3, t / n * 1e6)
+        return ret
+
+    def __str__(self):
+        return self.report()
+
+
+_active = None
+
+def enable():
+    """Starts global profiling and returns the :obj:`profiler`"""
+    global _active
+    if _active is None:
+        _active = profiler()
+    return _active
+
+def disable():
+    """Stops global profiling and returns the last :obj:`profiler`"""
+    global _active
+    prof, _active = _active, None
+    return prof
+
+@contextmanager
+def profile():
+    """Context manager profiling the enclosed code, yields :obj:`profiler`"""
+    global _active
+    previous = _active
+    _active = profiler()
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+def start():
+    """Returns start time if profiling is enabled, otherwise None"""
+    return None if _active is None else perf_counter()
+
+def stop(stage, t0):
+    """Records time elapsed from t0 returned by :func:`start`"""
+    if t0 is not None and _active is not None:
+        _active.add(stage, perf_counter() - t0)
+
+def timed(stage):
+    """Decorator recording time of every call of the function as given stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            t0 = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stop(stage, t0)
+        return wrapper
+    return decorator
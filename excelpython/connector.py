@@ -1,8 +1,41 @@
 from xlpython import *
-from CrysFiPy.reion import re, rawsusceptibility as susc
-import CrysFiPy.const as C
+from collections import OrderedDict
+from crysfipy.reion import re, susceptibility, magnetization, neutronint, \
+    rawsusceptibility as susc
+import crysfipy.const as C
 import numpy as np
 
+# diagonalized ions reused between recalculations of the sheet,
+# (ion, field, parameters) -> re
+_ions = OrderedDict()
+_CACHESIZE = 64
+
+def _flat(x):
+    '''Flattens value of a cell range to tuple, empty cells are skipped'''
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return tuple(v for item in x for v in _flat(item))
+    if x is None or x == "":
+        return ()
+    return (x,)
+
+def _column(x):
+    '''Converts cell range to 1D array of floats'''
+    return np.array(_flat(x), float)
+
+def _ion(name, field, B_pars):
+    '''Returns cached diagonalized ion'''
+    field = _column(field)
+    pars = _flat(B_pars)
+    key = (name.lower(), tuple(field), pars)
+    if key in _ions:
+        _ions.move_to_end(key)
+        return _ions[key]
+    ion = re(name, field, list(pars))
+    _ions[key] = ion
+    if len(_ions) > _CACHESIZE:
+        _ions.popitem(last = False)
+    return ion
+
 @xlfunc
 def GetJ2P1(name):
     '''Get number of CF energy levels'''
@@ -12,7 +45,7 @@ def GetJ2P1(name):
 @xlfunc
 def GetCF(name, field, B_pars):
     '''Get CF energy levels'''
-    ce = re(name, field, B_pars)
+    ce = _ion(name, field, B_pars)
     return np.concatenate((np.array(ce.rawenergy[:, np.newaxis]), ce.moment), axis=1)
 
 
@@ -27,8 +60,40 @@ def GetHParts(field):
 
 @xlfunc
 def GetSusc(energy, moment, H_direction, H_size, T):
-    '''Get Susceptibility'''
-    return susc(np.array(energy), np.array(moment), np.array(H_direction) , H_size, T)
+    '''Get Susceptibility, T can be a column of temperatures'''
+    chi = susc(np.array(energy), np.array(moment), _column(H_direction), H_size, _column(T))
+    if not isinstance(T, (list, tuple, np.ndarray)):
+        return float(chi[0])       # single cell as before
+    return chi[:, np.newaxis]
+
+
+@xlfunc
+def GetSuscT(name, field, B_pars, T):
+    '''Get column of susceptibilities in uB/T for a column of temperatures'''
+    return susceptibility(_ion(name, field, B_pars), _column(T))[:, np.newaxis]
+
+
+@xlfunc
+def GetMagH(name, direction, B_pars, H, T):
+    '''Get column of magnetizations in uB for a column of fields along direction at temperature T'''
+    ion = _ion(name, [0, 0, 0], B_pars)
+    return magnetization(ion, _column(H), [T], [_column(direction)])[:, 0, 0][:, np.newaxis]
+
+
+@xlfunc
+def GetNeutronInt(name, field, B_pars, T, direction = "t"):
+    '''Get energies (first column) and intensities (second column) of CF transitions'''
+    ion = _ion(name, field, B_pars)
+    return np.column_stack(neutronint(ion, T, direction or "t"))
+
+
+@xlfunc
+def CFCacheClear():
+    '''Removes all cached ions, returns their number'''
+    n = len(_ions)
+    _ions.clear()
+    return n
+
 
 @xlfunc
 def CFConvert(fromUnit, toUnit):
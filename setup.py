@@ -25,5 +25,8 @@ setup(name='crysfipy',
       install_requires=[
           'numpy',
       ],
+      extras_require={
+          'sparse': ['scipy'],
+      },
       include_package_data=True,
       zip_safe=False)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import crysfipy.cache
+from crysfipy.cache import diskcache
+from crysfipy.reion import re
+import numpy as np
+import pytest
+from pytest import approx
+
+PARS = ["t", -0.173477508, 0.001084591, -0.012701252, -3.34835E-06, 0.0000097]
+
+
+def test_re_uses_cache(tmp_path):
+    cache = crysfipy.cache.enable(tmp_path)
+    try:
+        first = re("Ho", [0, 0, 1], PARS)
+        assert cache.misses == 1 and cache.hits == 0
+        second = re("Ho", [0, 0, 1], PARS)
+        assert cache.hits == 1
+        assert "deg_Jx2" in vars(second)
+        assert second.energy == approx(first.energy)
+        assert second.deg_Jt2 == approx(first.deg_Jt2)
+        re("Ho", [0, 0, 2], PARS)
+        assert cache.misses == 2
+    finally:
+        crysfipy.cache.disable()
+    assert len(cache.entries()) == 2
+
+
+def test_sparse_key(tmp_path):
+    pytest.importorskip("scipy")
+    crysfipy.cache.enable(tmp_path)
+    try:
+        assert len(re("Ho", [0, 0, 1], PARS, solver = "sparse", k = 4).energy) == 4
+        assert len(re("Ho", [0, 0, 1], PARS, k = 4).energy) == 17
+    finally:
+        crysfipy.cache.disable()
+
+
+def test_failed_put(tmp_path, monkeypatch):
+    def locked(src, dst):
+        raise PermissionError("entry is opened by other process")
+    cache = crysfipy.cache.enable(tmp_path)
+    monkeypatch.setattr(crysfipy.cache.os, "replace", locked)
+    try:
+        ho = re("Ho", [0, 0, 1], PARS)
+        assert len(ho.energy) == 17
+    finally:
+        crysfipy.cache.disable()
+    assert cache.entries() == []
+    assert not any(f.name.endswith(".tmp") for f in tmp_path.iterdir())
+
+
+def test_lru_eviction(tmp_path):
+    cache = diskcache(tmp_path, maxbytes = 2500)
+    for k in range(3):
+        cache.put("k%d" % k, {"a": np.zeros(100)})
+    assert cache.get("k0") is None
+    assert cache.get("k2")["a"] == approx(np.zeros(100))
+    assert cache.size() <= 2500
+
+
+def test_key():
+    k = diskcache.key("Ho", [0, 0, 1], np.zeros(9))
+    assert k == diskcache.key("ho", np.array([0, 0, 1.0]), [0] * 9)
+    assert k != diskcache.key("Ho", [0, 0, 1.0001], np.zeros(9))
+
+
+def test_damaged_entry(tmp_path):
+    cache = diskcache(tmp_path)
+    cache.put("k", {"a": np.arange(1000.0)})
+    fname = tmp_path / "k.npz"
+    fname.write_bytes(fname.read_bytes()[:500])    # truncated by a crash
+    assert cache.get("k") is None
+    assert cache.misses == 1 and cache.hits == 0
+    assert not fname.exists()
+    assert cache.put("k", {"a": np.arange(3.0)})
+    assert cache.get("k")["a"] == approx([0, 1, 2])
+
+
+def test_put_without_scan(tmp_path, monkeypatch):
+    cache = diskcache(tmp_path, maxbytes = 20000)
+    scans = []
+    entries = cache.entries
+    monkeypatch.setattr(cache, "entries", lambda: scans.append(1) or entries())
+    for k in range(40):
+        cache.put("k%d" % k, {"a": np.zeros(100)})
+    # first write and the writes crossing maxbytes only
+    assert 1 < len(scans) < 20
+    assert cache.size() <= 20000
+    assert cache.get("k39") is not None
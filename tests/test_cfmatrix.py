@@ -0,0 +1,39 @@
+import crysfipy.cfmatrix as M
+import numpy as np
+import pytest
+from pytest import raises
+
+
+def test_operators_cached():
+    M.operators_cache_clear()
+    a = M.operators(2.5)
+    assert M.operators(2.5) is a
+    assert (2.5, 1) in M.operators_cache_info()
+    M.operators_cache_clear()
+    assert M.operators_cache_info() == {}
+
+
+def test_operators_content():
+    ops = M.operators(4)
+    assert ops.O.shape == (9, 9, 9)
+    assert np.allclose(ops.O[M.STEVENS.index("B44")], M.O_44(4))
+    assert np.allclose(ops.Jy, M.J_y(4))
+
+
+def test_operators_readonly():
+    ops = M.operators(3.5)
+    with raises(ValueError):
+        ops.O[0, 0, 0] = 1
+
+
+def test_sparse_operators():
+    pytest.importorskip("scipy")
+    for J in (2.5, 4, 8):
+        dense = M.operators(J)
+        sparse = M.operators(J, sparse = True)
+        assert M.operators(J, sparse = True) is sparse
+        for k in range(len(M.STEVENS)):
+            assert np.allclose(sparse.O[k].toarray(), dense.O[k])
+            assert sparse.O[k].nnz <= 7 * (2 * J + 1)
+        assert np.allclose(sparse.Jy.toarray(), dense.Jy)
+    assert (8.0, 1, "sparse") in M.operators_cache_info()
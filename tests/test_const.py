@@ -1,5 +1,5 @@
 import crysfipy.const as C
-from pytest import approx
+from pytest import approx, raises
 
 def test_R0():
     assert C.R0 == approx(-5.390841372421595e-15)
@@ -9,6 +9,26 @@ def test_ion():
     assert C.ion("Ho").Beta == approx(-3.330003330003329e-05)
     assert C.ion("Ho").Gamma == approx(-9.951596826260624e-08)
 
+def test_ion_lookup():
+    ho = C.ion("Ho")
+    assert C.ion("ho") is ho
+    assert C.ion("HO3+") is ho
+    assert C.ion(" Ho+3") is ho
+    assert ho.J2p1 == 17
+    assert str(C.ion("Ce3+")) == "Ce3+: J = 2, gJ = 0.86"
+    with raises(KeyError):
+        C.ion("Xx")
+    with raises(AttributeError):
+        ho.J = 1
+
+def test_iontable():
+    table = C.iontable()
+    assert len(table) == len(C.ions())
+    assert list(table["name"]) == [i.name for i in C.ions()]
+    assert table["gJ"] == approx([i.gJ for i in C.ions()])
+    assert table["Gamma"][table["name"] == "ho"][0] == C.ion("Ho").Gamma
+    assert not table.flags.writeable
+
 def test_uB():
     assert C.uB == approx(0.6717138840811654)
 
@@ -0,0 +1,52 @@
+from crysfipy.fit import fit, chidata, magdata, insdata
+from crysfipy.reion import re, susceptibility, neutronint
+import numpy as np
+from pytest import approx, raises
+
+TRUE = ["t", -0.17, 0.0011, -0.0127]
+
+
+def _data():
+    T = np.linspace(2, 300, 40)
+    ion = re("Ho", [0, 0, 0.1], TRUE)
+    chi = chidata(T, susceptibility(ion, T), [0, 0, 0.1])
+    ion0 = re("Ho", [0, 0, 0], TRUE)
+    I = neutronint(ion0, 5)[1][np.argsort(np.argsort(
+        (ion0.deg_e[:, 0] - ion0.deg_e[:, 0][:, np.newaxis]).flatten()))][1:4]
+    ins = insdata(ion0.deg_e[1:4, 0], I * 7, T = 5, weight = 10)
+    H = np.array([0.0, 1.0, 5.0])
+    M = [susceptibility(re("Ho", [h, 0, 0], TRUE), 10) * h if h else 0 for h in H]
+    return [chi, ins, magdata(H, M, 10, [1, 0, 0])]
+
+
+def test_fit_recovers_parameters():
+    res = fit("Ho", ["t", -0.15, 0.001, -0.012], _data(), free = ["B20", "B40", "B44"])
+    assert res.success
+    assert res.cost < 1e-12
+    assert [res.cfp.B20, res.cfp.B40, res.cfp.B44] == approx(TRUE[1:], rel = 1e-5)
+    assert all("model" in h and "solve" in h for h in res.history)
+
+
+def test_fit_callback_and_cache():
+    calls = []
+    def stop(state):
+        calls.append(state.cost)
+        return len(calls) == 2
+    res = fit("Ho", ["t", -0.15, 0.001, -0.012], _data(), free = ["B20", "B40", "B44"],
+              callback = stop)
+    assert not res.success and len(res.history) == 2
+    assert res.message == "stopped by callback"
+
+
+def test_fit_cubic_constrains():
+    ce = re("Ce", [0, 0, 0], ["c", 0.5])
+    res = fit("Ce", ["c", 0.3], [insdata(ce.deg_e[1:, 0])])
+    assert res.free == ["B40", "B60"]
+    assert res.cfp.B40 == approx(0.5)
+    assert res.cfp.B44 == approx(2.5)
+
+
+def test_fit_too_many_peaks():
+    # Ce in tetragonal field has only two excited doublets
+    with raises(ValueError):
+        fit("Ce", ["t", .8, .02], [insdata([3, 17.4, 99])])
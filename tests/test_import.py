@@ -0,0 +1,31 @@
+import subprocess
+import sys
+import crysfipy
+
+
+def _run(code):
+    return subprocess.run([sys.executable, "-c", code], stdout = subprocess.PIPE,
+                          universal_newlines = True, check = True).stdout.strip()
+
+
+def test_lazy_import():
+    code = ("import sys, crysfipy, crysfipy.const\n"
+            "crysfipy.ion('Ho'); crysfipy.uB\n"
+            "print('numpy' in sys.modules, 'crysfipy.reion' in sys.modules)")
+    assert _run(code) == "False False"
+
+
+def test_public_names():
+    from crysfipy.reion import re, susceptibility
+    from crysfipy.cfmatrix import O_20
+    from crysfipy.const import ion, uB
+    assert crysfipy.re is re
+    assert crysfipy.susceptibility is susceptibility
+    assert crysfipy.O_20 is O_20
+    assert crysfipy.ion is ion
+    assert crysfipy.uB == uB
+    assert crysfipy.spectrum.spectrum
+    assert "re" in dir(crysfipy)
+    names = {}
+    exec("from crysfipy import *", names)
+    assert {"re", "cfpars", "neutronint", "J_z", "STEVENS", "uB", "ion"} <= set(names)
@@ -0,0 +1,40 @@
+from crysfipy.powder import quadrature, reduce, symmetry, powder_magnetization, \
+    powder_susceptibility, quadrature_cache_info
+from crysfipy.reion import re, magnetization
+import crysfipy.const as C
+import numpy as np
+from pytest import approx
+
+
+def test_quadrature_exact():
+    for order, method in ((11, "lebedev"), (6, "gauss")):
+        p, w = quadrature(order, method)
+        assert np.sum(w) == approx(1)
+        assert np.sum(w * p[:, 2]**4) == approx(1.0 / 5)
+        assert np.sum(w * p[:, 0]**2 * p[:, 1]**2 * p[:, 2]**2) == approx(1.0 / 105)
+    assert quadrature(11) is quadrature(11)
+    assert ("lebedev", 11) in quadrature_cache_info()
+
+
+def test_symmetry_reduction():
+    pars = {
+        "t": ["t", -0.17, 0.001, -0.0127],
+        "h": ["h", -0.17, 0.001, 1e-5, 2e-6],
+        "c": ["c", 0.001, 1e-5],
+        "o": ["o", -0.17, 0.02, 0.001, 0.002, -0.0127],
+    }
+    H, T = [1.0, 6.0], [2.0, 20.0]
+    for sym, cfp in pars.items():
+        ion = re("Ho", [0, 0, 0], cfp)
+        assert symmetry(ion._pars) == sym
+        p, w = quadrature(11)
+        rp, rw = reduce(p, w, sym)
+        assert len(rp) < len(p)
+        full = magnetization(ion, H, T, p, w)
+        assert powder_magnetization(ion, H, T) == approx(full)
+
+
+def test_powder_curie():
+    ion = re("Dy", [0, 0, 0], ["t", 0.05, 0.0002, 0.001])
+    curie = ion.gJ**2 * ion.J * (ion.J + 1) * C.uB / 3
+    assert powder_susceptibility(ion, 3000.0) == approx(curie / 3000, rel = 1e-3)
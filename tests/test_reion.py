@@ -1 +1,301 @@
+from crysfipy.reion import re, rebatch, susceptibility, rawsusceptibility, neutronint, neutronint_grid
+from crysfipy.reion import susceptibility_jacobian, neutronint_jacobian, magnetization, profile
+from crysfipy.reion import susceptibility_tensor
+import crysfipy.timing
+from crysfipy.cfmatrix import STEVENS
+import crysfipy.const as C
+import numpy as np
+import pytest
+from pytest import approx
 
+
+def test_cubic_ce():
+    ce = re("Ce", [0, 0, 0], ["c", 10])
+    assert ce.deg_e[:, 0] == approx([0, 3600])
+    assert ce.deg_e[:, 1] == approx([2, 4])
+
+
+def _ho():
+    return re("Ho", [1, 0, 0], ["t", -0.173477508, 0.001084591, -0.012701252,
+                                -3.34835E-06, 0.0000097])
+
+
+def test_tetragonal_ho():
+    ho = _ho()
+    assert len(ho.deg_e) == 17
+    assert ho.deg_e[1:4, 0] == approx([5.500271185019, 6.344233701386, 11.854345361476])
+    assert ho.deg_e[-1, 0] == approx(104.664918166207)
+
+
+def test_susceptibility_ho():
+    chi = susceptibility(_ho(), [5, 10, 50, 300])
+    assert chi == approx([4.808266334857692, 2.5585887891418673,
+                          0.481032942885668, 0.08271869968736612])
+
+
+def test_susceptibility_curie():
+    ho = re("Ho", [0, 0, 1e-3], ["t", 0.01])
+    curie = ho.gJ**2 * ho.J * (ho.J + 1) * C.uB / 3
+    assert susceptibility(ho, 1e4) == approx(curie / 1e4, rel = 1e-3)
+
+
+def test_eigvals_only():
+    ho = re("Ho", [1, 0, 0], ["t", -0.173477508, 0.001084591, -0.012701252,
+                              -3.34835E-06, 0.0000097], eigvals_only = True)
+    assert ho.deg_e == approx(_ho().deg_e)
+    assert not hasattr(ho, "deg_Jx2")
+
+
+def test_rebatch_matches_re():
+    ho = _ho()
+    p = [getattr(ho.cfp, name) for name in STEVENS]
+    b = rebatch("Ho", [1, 0, 0], [p, np.zeros(9), p])
+    assert len(b) == 3
+    assert b.energy.shape == (3, 17)
+    assert b.deg_e[2] == approx(ho.deg_e)
+    assert b.deg_Jt2[0] == approx(ho.deg_Jt2)
+    assert b.energy[1] == approx(np.arange(17) * C.uB * 1.25)
+
+
+def test_rebatch_degeneracy():
+    b = rebatch("Ce", [0, 0, 0], [[0, 0, 10, 0, 50, 0, 0, 0, 0], np.zeros(9)])
+    assert list(b.nlevels) == [2, 1]
+    assert b.deg_e[0, :2, 1] == approx([2, 4])
+    assert b.deg_e[1, 0, 1] == 6
+    assert b.deg_Jz2[1, 1:] == approx(0)
+
+
+def test_susceptibility_array():
+    ho = _ho()
+    T = np.linspace(0.01, 300, 50)
+    chi = susceptibility(ho, T)
+    assert isinstance(chi, np.ndarray) and chi.shape == T.shape
+    assert chi[1:] == approx([susceptibility(ho, t) for t in T[1:]])
+    assert np.all(np.isfinite(chi))
+
+
+def test_rawsusceptibility():
+    ho = _ho()
+    T = [5, 50]
+    chi = rawsusceptibility(ho.rawenergy.tolist(), ho.moment.tolist(), list(ho.H_direction), ho.H_size, T)
+    assert chi == approx(susceptibility(ho, T))
+
+
+def test_neutronint_grid():
+    ho = _ho()
+    T = [2, 10, 300]
+    E, I = neutronint_grid(ho, T, "xzt")
+    assert I.shape == (3, 3, 17 * 17)
+    for k, t in enumerate(T):
+        for l, d in enumerate("xzt"):
+            ref = neutronint(ho, t, d)
+            assert E == approx(ref[0])
+            assert I[k, l] == approx(ref[1])
+
+
+def test_setpar_setfield():
+    ho = _ho()
+    ref = re("Ho", [0, 0, 2], ["t", -0.173477508, 0.001084591, -0.012701252,
+                               -3.34835E-06, 0.0000097])
+    ho.setfield([0, 0, 2])
+    ho.setpar("B22", 0.01)
+    ho.setpar("B22", 0)
+    assert ho.energy == approx(ref.energy)
+    assert ho.deg_Jz2 == approx(ref.deg_Jz2)
+    assert susceptibility(ho, 10) == approx(susceptibility(ref, 10))
+    ho.setpar("B40", 0.002)
+    assert ho.cfp.B40 == 0.002
+    assert ho.hamiltonian == approx(re("Ho", [0, 0, 2], ["t", -0.173477508, 0.002, 
+        -0.012701252, -3.34835E-06, 0.0000097]).hamiltonian)
+
+
+def test_getlevels_reads_cfp():
+    ce = re("Ce", [0, 0, 0], ["c", 10])
+    ce.cfp.B40 = 1
+    ce.cfp.B44 = 5
+    assert ce.getlevels()[:, 0] == approx([0, 360])
+
+
+def test_lazy_observables():
+    ho = _ho()
+    assert "deg_Jx2" not in vars(ho) and "Jx" not in vars(ho)
+    assert ho.moment[:, 0] == approx(-ho.gJ * np.real(np.diag(ho.Jx)))
+    ho.setpar("B20", 0)
+    assert "Jx" not in vars(ho) and "rawenergy" not in vars(ho)
+
+
+def test_degeneracy_tolerance():
+    ho = re("Ho", [0, 0, 1e-3], ["t", -0.17, 0.001, -0.0127, -3.3e-6, 1e-5])
+    split = len(ho.deg_e)
+    ho = re("Ho", [0, 0, 1e-3], ["t", -0.17, 0.001, -0.0127, -3.3e-6, 1e-5], 
+            rtol = 0, atol = 0.1)
+    assert len(ho.deg_e) < split
+    assert np.sum(ho.deg_e[:, 1]) == 17
+    assert np.sum(ho.deg_Jt2) == approx(np.sum(2.0 / 3 * (ho.Jx2 + ho.Jy2 + ho.Jz2)))
+
+
+def _fd(f, ion_factory, k, step):
+    a = ion_factory()
+    a.setpar(STEVENS[k], a._pars[k] + step)
+    b = ion_factory()
+    b.setpar(STEVENS[k], b._pars[k] - step)
+    return (f(a) - f(b)) / 2 / step
+
+
+def test_jacobians():
+    def factory():
+        ion = re("Ho", [0, 0, 1], ["t", -0.173477508, 0.001084591, -0.012701252,
+                                   -3.34835E-06, 0.0000097])
+        ion.setpar("B22", 0.003)
+        return ion
+    ho = factory()
+    T = np.array([5.0, 50.0])
+    jE = ho.energy_jacobian()
+    jS = susceptibility_jacobian(ho, T)
+    jN = neutronint_jacobian(ho, 20)
+    for k in (0, 1, 3, 6):
+        step = 1e-5 / np.abs(ho._ops.O[k]).max()
+        assert jE[:, k] == approx(_fd(lambda i: i.energy, factory, k, step), rel = 1e-5, abs = 1e-5)
+        assert jS[:, k] == approx(_fd(lambda i: susceptibility(i, T), factory, k, step), rel = 1e-3)
+        fdN = _fd(lambda i: neutronint(i, 20), factory, k, step)
+        assert jN[0, :, k] == approx(fdN[0], rel = 1e-5, abs = 1e-4)
+        assert jN[1, :, k] == approx(fdN[1], rel = 1e-5, abs = 1e-3)
+
+
+def test_rebatch_energy_jacobian():
+    dy = re("Dy", [0, 0, 0], ["t", -0.3, 0.002, -0.0127, -3.3e-6, 1e-5])
+    b = rebatch("Dy", [0, 0, 0], [dy._pars, dy._pars * 2])
+    assert b.energy_jacobian().shape == (2, 16, 9)
+    assert b.energy_jacobian()[0] == approx(dy.energy_jacobian(), abs = 1e-8)
+
+
+def test_rebatch_jacobians():
+    T = np.array([5.0, 50.0])
+    pars = (["t", 0.8, 0.02], ["c", 0.5])   # three and two levels in zero field
+    for field in ([[0, 0, 0], [0, 0, 0]], [[0, 0, 1], [0, 0, 1]], [[0, 0, 1], [1, 1, 0]]):
+        ions = [re("Ce", f, p) for f, p in zip(field, pars)]
+        b = rebatch("Ce", field, [ion._pars for ion in ions])
+        jN = neutronint_jacobian(b, 20)
+        assert jN.shape == (2, 2, 36, 9)
+        for k, ion in enumerate(ions):
+            m = len(ion.deg_e)**2
+            assert jN[k, :, :m] == approx(neutronint_jacobian(ion, 20), rel = 1e-8, abs = 1e-10)
+            assert np.all(jN[k, :, m:] == 0)
+        if ions[0].H_size > 0:
+            jS = susceptibility_jacobian(b, T)
+            assert jS.shape == (2, 2, 9)
+            for k, ion in enumerate(ions):
+                assert jS[k] == approx(susceptibility_jacobian(ion, T), rel = 1e-8, abs = 1e-10)
+    assert susceptibility_jacobian(rebatch("Ce", [0, 0, 1], b.pars), 10).shape == (2, 9)
+
+
+def test_block_solver():
+    pars = ["t", -0.173477508, 0.001084591, -0.012701252, -3.34835E-06, 0.0000097]
+    for field in ([0, 0, 0], [0, 0, 2]):
+        block = re("Ho", field, pars, solver = "block")
+        dense = re("Ho", field, pars, solver = "dense")
+        assert len(block._blocks()) == 4 and dense._blocks() is None
+        assert re("Ho", field, pars)._blocks() is None
+        assert block.energy == approx(dense.energy)
+        assert block.deg_Jx2 == approx(dense.deg_Jx2)
+        assert np.abs(block.ev.T @ block.ev) == approx(np.eye(17), abs = 1e-12)
+    assert block.moment == approx(dense.moment, abs = 1e-10)
+    assert re("Ho", [1, 0, 0], pars, solver = "block")._blocks() is None
+    assert len(re("Ho", [0, 0, 0], ["h", 0.1, 0, 0, 0.001], solver = "block")._blocks()) == 6
+    assert len(re("Ho", [0, 0, 1], ["h", 0.1], solver = "block")._blocks()) == 17
+
+
+def test_rebatch_block_solver():
+    ho = _ho()
+    P = [ho._pars, ho._pars * 0.5, ho._pars * [1, 0, 2, 0, 1, 1, 0, 1, 0]]
+    block = rebatch("Ho", [0, 0, 3], P)
+    dense = rebatch("Ho", [0, 0, 3], P, solver = "dense")
+    assert block.energy == approx(dense.energy)
+    assert block.moment == approx(dense.moment, abs = 1e-10)
+    assert block.deg_Jt2 == approx(dense.deg_Jt2)
+
+
+def test_magnetization():
+    ho = _ho()
+    H = np.array([0.5, 2.0, 7.0])
+    T = np.array([2.0, 30.0])
+    d = [[1, 0, 0], [0, 0, 1], [1, 1, 1]]
+    M = magnetization(ho, H, T, d, chunksize = 4)
+    assert M.shape == (3, 2, 3)
+    for i, h in enumerate(H):
+        for k, direction in enumerate(d):
+            field = h * np.array(direction) / np.sqrt(np.dot(direction, direction))
+            ion = re("Ho", field, ["t", -0.173477508, 0.001084591, -0.012701252,
+                                   -3.34835E-06, 0.0000097])
+            assert M[i, :, k] == approx(susceptibility(ion, T) * h)
+    avg = magnetization(ho, H, T, d, weights = [1, 1, 2])
+    assert avg == approx((M[..., 0] + M[..., 1] + 2 * M[..., 2]) / 4)
+
+
+def test_profile():
+    T = np.linspace(1, 300, 10)
+    with profile() as prof:
+        ho = _ho()
+        susceptibility(ho, T)
+        neutronint(ho, 10)
+        ho.getlevels()
+    stats = prof.stats()
+    assert stats["re._calculate"]["calls"] == 2
+    assert stats["re.getlevels"]["calls"] == 2
+    assert stats["susceptibility"]["calls"] == 1
+    assert stats["neutronint"]["calls"] == 1
+    for stage in ("re._calculate.assembly", "re._calculate.eig", "re.transform", "re.degeneracy"):
+        assert stats[stage]["time"] >= 0
+    assert "re._calculate.eig" in prof.report()
+    # disabled outside of the context
+    assert crysfipy.timing._active is None
+    susceptibility(ho, T)
+    assert prof.stats()["susceptibility"]["calls"] == 1
+
+
+def test_sparse_solver():
+    pytest.importorskip("scipy")
+    pars = ["t", -0.173477508, 0.001084591, -0.012701252, -3.34835E-06, 0.0000097]
+    for field in ([0, 0, 0], [0, 0.5, 1]):
+        dense = re("Ho", field, pars)
+        sparse = re("Ho", field, pars, solver = "sparse", k = 5)
+        assert sparse.energy == approx(dense.energy[:5], abs = 1e-8)
+        assert len(sparse.ev[0]) == 5
+        assert sparse.deg_e[:, 0] == approx(dense.deg_e[:len(sparse.deg_e), 0], abs = 1e-8)
+        assert re("Ho", field, pars, solver = "sparse", k = 5, eigvals_only = True).energy == \
+            approx(dense.energy[:5], abs = 1e-8)
+    # ground state observables agree at low temperature
+    field = [0, 0, 1]
+    dense = re("Ho", field, pars)
+    sparse = re("Ho", field, pars, solver = "sparse", k = 4)
+    assert sparse.moment[:2] == approx(dense.moment[:2])
+    assert susceptibility(sparse, 1) == approx(susceptibility(dense, 1), rel = 1e-5)
+    # falls back to full diagonalization without k
+    assert re("Ho", field, pars, solver = "sparse").energy == approx(dense.energy)
+    # no dense operators are built, parameter updates work on sparse hamiltonian
+    assert isinstance(sparse._ops.O, tuple)
+    sparse.setpar("B22", 0.01)
+    dense.setpar("B22", 0.01)
+    assert sparse.energy == approx(dense.energy[:4], abs = 1e-8)
+    assert sparse.energy_jacobian() == approx(dense.energy_jacobian()[:4], rel = 1e-8, abs = 1e-8)
+    assert magnetization(sparse, [1, 2], [5]) == approx(magnetization(dense, [1, 2], [5]))
+
+
+def test_susceptibility_tensor():
+    pars = ["t", -0.173477508, 0.001084591, -0.012701252, -3.34835E-06, 0.0000097]
+    T = np.array([2.0, 10.0, 100.0])
+    chi = susceptibility_tensor(re("Ho", [0, 0, 0], pars), T)
+    assert chi.shape == (3, 3, 3)
+    assert chi == approx(np.swapaxes(chi, -1, -2))
+    h = 1e-4
+    for d in ([1, 0, 0], [0, 0, 1], [1, 1, 1]):
+        d = np.array(d) / np.linalg.norm(d)
+        finite = susceptibility(re("Ho", h * d, pars), T)
+        assert np.einsum("a,...ab,b->...", d, chi, d) == approx(finite, rel = 1e-4)
+    # differential susceptibility in finite field
+    field = np.array([0, 0, 2.0])
+    dH = np.array([0, 0, 1e-4])
+    M1 = susceptibility(re("Ho", field + dH, pars), T) * 2.0001
+    M0 = susceptibility(re("Ho", field - dH, pars), T) * 1.9999
+    chi = susceptibility_tensor(re("Ho", field, pars), T)
+    assert chi[:, 2, 2] == approx((M1 - M0) / 2e-4, rel = 1e-4)
@@ -0,0 +1,74 @@
+from crysfipy.scan import scan, parameters, scanstore, load
+from crysfipy.reion import re
+import numpy as np
+from pytest import approx, raises
+
+
+def test_parameters_cubic():
+    P = parameters("c", {"B40": [1, 2], "B60": [0.1, 0]})
+    assert P[:, 4] == approx([5, 10])
+    assert P[:, 7] == approx([-2.1, 0])
+    with raises(ValueError):
+        parameters("t", {"B22": [1]})
+
+
+def test_scan_grid():
+    axes = {"B20": np.linspace(-0.2, 0.2, 3), "B40": np.linspace(-0.01, 0.01, 4)}
+    r = scan("Pr", axes, sym = "t", field = [0, 0, 0.5], workers = 1, chunksize = 5)
+    assert r.shape == (3, 4)
+    assert r.energy.shape == (3, 4, 9)
+    assert r.moment.shape == (3, 4, 9, 3)
+    ion = re("Pr", [0, 0, 0.5], ["t", axes["B20"][1], axes["B40"][2]])
+    assert r.energy[1, 2] == approx(ion.energy)
+    assert r.moment[1, 2] == approx(ion.moment)
+    assert r.nlevels[1, 2] == len(ion.deg_e)
+
+
+def test_scan_pool_deterministic():
+    axes = {"field": [[0, 0, 0], [1, 0, 0], [0, 0, 2]], "B40": np.linspace(-0.01, 0.01, 7)}
+    serial = scan("Ce", axes, sym = "c", workers = 1, chunksize = 4)
+    pool = scan("Ce", axes, sym = "c", workers = 2, chunksize = 4)
+    assert pool.energy == approx(serial.energy)
+    assert pool.deg_e == approx(serial.deg_e)
+    assert serial.field[7] == approx([1, 0, 0])
+    assert serial.energy.shape == (3, 7, 6)
+
+
+def test_scan_complex_chunks():
+    # first chunk is real, the second one has y field and complex eigenvectors
+    axes = {"field": [[0, 0, 1], [0, 1, 0]], "B20": [0.1, 0.2]}
+    r = scan("Pr", axes, sym = "t", observables = ("ev",), workers = 1, chunksize = 2)
+    assert r.ev.dtype == complex
+    ion = re("Pr", [0, 1, 0], ["t", 0.2])
+    assert np.abs(r.ev[1, 1]) == approx(np.abs(ion.ev))
+
+
+def test_scan_store(tmp_path):
+    axes = {"field": [[0, 0, 0], [0, 1, 0]], "B20": np.linspace(-0.2, 0.2, 5)}
+    obs = ("energy", "ev", "nlevels", "deg_Jt2")
+    ref = scan("Pr", axes, sym = "t", observables = obs, workers = 1, chunksize = 3)
+    out = str(tmp_path / "pr")
+    r = scan("Pr", axes, sym = "t", observables = obs, workers = 1, chunksize = 3, out = out)
+    assert isinstance(r.energy, np.memmap) and not r.energy.flags.writeable
+    for name in obs:
+        assert getattr(r, name) == approx(getattr(ref, name))
+    # interrupted scan: second chunk is missing, first one must not be recalculated
+    store = scanstore(out)
+    assert store.done.all()
+    done = np.load(out + "/done.npy", mmap_mode = "r+")
+    done[1] = False
+    done.flush()
+    energy = np.load(out + "/energy.npy", mmap_mode = "r+")
+    energy[:6] = -1
+    energy.flush()
+    del done, energy
+    assert store.todo() == [3]
+    r = scan("Pr", axes, sym = "t", observables = obs, workers = 1, chunksize = 3, out = out)
+    assert r.energy.reshape(-1, 9)[:3] == approx(-np.ones((3, 9)))
+    assert r.energy.reshape(-1, 9)[3:] == approx(ref.energy.reshape(-1, 9)[3:])
+    assert load(out).deg_Jt2 == approx(ref.deg_Jt2)
+    assert load(out).field[7] == approx([0, 1, 0])
+    with raises(ValueError):
+        scan("Pr", axes, sym = "t", observables = obs, workers = 1, chunksize = 4, out = out)
+    with raises(ValueError):
+        scan("Pr", axes, sym = "t", observables = ("Jx", "foo"), out = str(tmp_path / "x"))
@@ -0,0 +1,28 @@
+from crysfipy.reion import re, neutronint, neutronint_grid
+from crysfipy.spectrum import spectrum, gaussian, lorentzian, pseudovoigt
+import numpy as np
+from pytest import approx
+
+
+def test_profiles_normalized():
+    x = np.linspace(-2000, 2000, 400001)
+    for f in (gaussian, lorentzian, pseudovoigt):
+        assert np.sum(f(x, 3, 2)) * (x[1] - x[0]) == approx(1, abs = 1e-3)
+    assert gaussian(1, 0, 2) == approx(gaussian(0, 0, 2) / 2)
+    assert lorentzian(1, 0, 2) == approx(lorentzian(0, 0, 2) / 2)
+
+
+def test_spectrum_batch():
+    ho = re("Ho", [0, 0, 0], ["t", -0.17, 0.001, -0.0127, -3.3e-6, 1e-5])
+    E = np.linspace(-10, 60, 701)
+    single = spectrum(E, *neutronint(ho, 10, "t"), fwhm = 1, profile = "gaussian")
+    jumps, I = neutronint_grid(ho, [10, 50], "tx")
+    batch = spectrum(E, jumps, I, fwhm = 1, profile = "gaussian")
+    assert batch.shape == (2, 2, 701)
+    assert batch[0, 0] == approx(single)
+
+
+def test_spectrum_cutoff():
+    E = np.linspace(0, 10, 101)
+    S = spectrum(E, [2, 5], [1, 1e-9], [0.5, 1], cutoff = 1e-6)
+    assert S == approx(lorentzian(E, 2, 0.5))
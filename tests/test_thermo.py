@@ -0,0 +1,53 @@
+from crysfipy.reion import re, rebatch
+from crysfipy.thermo import thermodynamics, heat_capacity, entropy
+import crysfipy.const as C
+import numpy as np
+import pytest
+from pytest import approx
+
+
+def test_two_level():
+    T = np.array([0.5, 1, 5, 50])
+    th = thermodynamics([0, 0, 3], T, units = "K")
+    x = 3 / T
+    Z = 2 + np.exp(-x)
+    assert th.Z == approx(Z)
+    assert th.U == approx(3 * np.exp(-x) / Z)
+    assert th.C == approx(2 * x**2 * np.exp(-x) / Z**2)
+    assert th.S == approx(np.log(Z) + th.U / T)
+    assert th.F == approx(-T * np.log(Z))
+
+
+def test_units_and_offset():
+    T = np.linspace(1, 300, 7)
+    meV = thermodynamics([1, 2, 5], T)
+    K = thermodynamics(np.array([1, 2, 5]) * C.eV2K, T, units = "K")
+    assert meV.C == approx(K.C)
+    assert meV.U * C.eV2K == approx(K.U)
+    assert meV.F * C.eV2K == approx(K.F)
+    with pytest.raises(ValueError):
+        thermodynamics([0, 1], T, units = "J")
+
+
+def test_overflow_safe():
+    th = thermodynamics([-1e4, -1e4, 1e4], [0.01, 1e6], units = "K")
+    assert np.all(np.isfinite(th))
+    assert th.S == approx([np.log(2), np.log(3)], rel = 1e-3)
+    assert th.F[0] == approx(-1e4 - 0.01 * np.log(2))
+
+
+def test_ions():
+    pars = ["t", -0.173477508, 0.001084591, -0.012701252, -3.34835E-06, 0.0000097]
+    ho = re("Ho", [0, 0, 0], pars)
+    T = np.linspace(1, 300, 50)
+    assert heat_capacity(ho, T) == approx(heat_capacity(ho.energy, T))
+    assert entropy(ho, 1e5) == approx(np.log(17), rel = 1e-3)
+    b = rebatch("Ho", [0, 0, 0], [ho._pars, 0.5 * ho._pars])
+    C2 = heat_capacity(b, T)
+    assert C2.shape == (2, 50)
+    assert C2[0] == approx(heat_capacity(ho, T))
+    # entropy is integral of C/T
+    Tf = np.linspace(1, 2000, 200001)
+    S = entropy(ho, Tf)
+    c = heat_capacity(ho, Tf) / Tf
+    assert S[-1] - S[0] == approx(np.sum((c[1:] + c[:-1]) / 2) * (Tf[1] - Tf[0]), rel = 1e-4)